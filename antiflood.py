@@ -0,0 +1,159 @@
+"""Flood control for incoming updates.
+
+Each user gets a token bucket of `burst` updates refilled at `rate` per
+second. A bucket is stored as a single float, the time at which it will be
+full again (the GCRA form of a token bucket), in an insertion-ordered table;
+full buckets are dropped from the front of the table, so it only holds users
+who were active in the last few seconds.
+
+Repeated taps on the same button are dropped within `dedupe_window`, and
+while more than `shed_depth` updates wait to be handled new ones are
+answered with a "please wait" message instead of being handled.
+
+The check runs in SchedulingDispatcher.feed_update, before the update waits
+for its user's lock or a concurrency slot, and the replies to dropped
+updates are sent in background tasks, so dropping costs neither.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+
+from catalog import get_catalog
+from language_store import LanguageStore
+from metrics import Counter, registry
+
+logger = logging.getLogger(__name__)
+
+dropped_total = registry.register(Counter(
+    "bot_updates_dropped_total", "Updates dropped by flood control, by reason", ("reason",)))
+
+# Table entries removed per update at most, so pruning never takes long
+_PRUNE_BATCH = 8
+
+
+class Antiflood:
+    """Drops updates of users who send too many (gate of SchedulingDispatcher)"""
+
+    def __init__(
+        self,
+        store: LanguageStore,
+        rate: float = 2.0,
+        burst: int = 10,
+        dedupe_window: float = 1.0,
+        shed_depth: Optional[int] = None,
+        depth: Optional[Callable[[], int]] = None,
+        warn_interval: float = 5.0
+    ):
+        self.store = store
+        self.interval = 1.0 / rate
+        # How far ahead of now a bucket's "full again" time may be
+        self.tolerance = burst * self.interval
+        self.dedupe_window = dedupe_window
+        self.shed_depth = shed_depth
+        self.depth = depth
+        self.warn_interval = warn_interval
+        self._full_at: "OrderedDict[int, float]" = OrderedDict()
+        self._recent: "OrderedDict[Tuple[int, int, str], float]" = OrderedDict()
+        self._warned: "OrderedDict[int, float]" = OrderedDict()
+        self._replies: Set[asyncio.Task] = set()
+
+    def _prune(self, now: float) -> None:
+        table = self._full_at
+        for _ in range(_PRUNE_BATCH):
+            if not table:
+                break
+            user_id, full_at = next(iter(table.items()))
+            if full_at > now:
+                break
+            del table[user_id]
+        for table, ttl in ((self._recent, self.dedupe_window), (self._warned, self.warn_interval)):
+            for _ in range(_PRUNE_BATCH):
+                if not table or next(iter(table.values())) + ttl > now:
+                    break
+                table.popitem(last=False)
+
+    def allow(self, user_id: int, now: float) -> bool:
+        """Take a token from the user's bucket if there is one"""
+        full_at = max(self._full_at.get(user_id, now), now) + self.interval
+        if full_at - now > self.tolerance:
+            return False
+        self._full_at[user_id] = full_at
+        self._full_at.move_to_end(user_id)
+        return True
+
+    def is_repeat(self, user_id: int, callback: Any, now: float) -> bool:
+        """Same button of the same message pressed again within the window"""
+        key = (user_id, callback.message.message_id if callback.message else 0, callback.data or '')
+        seen = self._recent.get(key)
+        if seen is not None and now - seen < self.dedupe_window:
+            return True
+        self._recent[key] = now
+        self._recent.move_to_end(key)
+        return False
+
+    async def _reply(self, bot: Bot, callback: Any, chat_id: Optional[int], text: Optional[str]) -> None:
+        try:
+            if callback is not None:
+                await bot.answer_callback_query(callback.id, text=text)
+            elif chat_id is not None and text:
+                await bot.send_message(chat_id=chat_id, text=text)
+        except TelegramAPIError as e:
+            logger.warning(f"Failed to answer a dropped update: {e}")
+
+    def reply(self, bot: Bot, callback: Any, chat_id: Optional[int] = None, text: Optional[str] = None) -> None:
+        """Answer a dropped update in the background, outside the concurrency limit"""
+        task = asyncio.create_task(self._reply(bot, callback, chat_id, text))
+        self._replies.add(task)
+        task.add_done_callback(self._replies.discard)
+
+    def warn(self, bot: Bot, update: Update, user_id: int, now: float) -> None:
+        """Tell the user to slow down, at most once per warn_interval"""
+        callback = update.callback_query
+        last = self._warned.get(user_id)
+        if last is not None and now - last < self.warn_interval:
+            if callback is not None:
+                # Still stop the button's loading spinner
+                self.reply(bot, callback)
+            return
+        self._warned[user_id] = now
+        self._warned.move_to_end(user_id)
+        # Only the cached language: no database reads while flooding or overloaded
+        text = get_catalog().translations[self.store.get(user_id, 'ru')]['please_wait']
+        self.reply(bot, callback, update.message.chat.id if update.message else None, text)
+
+    def check(self, bot: Bot, update: Update) -> bool:
+        """True if the update should be handled, False if it was dropped"""
+        event = update.message or update.callback_query
+        user = event.from_user if event is not None else None
+        if user is None:
+            return True
+        now = time.monotonic()
+        self._prune(now)
+        callback = update.callback_query
+        if callback is not None and self.is_repeat(user.id, callback, now):
+            dropped_total.inc("repeat")
+            self.reply(bot, callback)
+            return False
+        if not self.allow(user.id, now):
+            dropped_total.inc("rate")
+            self.warn(bot, update, user.id, now)
+            return False
+        if self.shed_depth is not None and self.depth is not None and self.depth() > self.shed_depth:
+            dropped_total.inc("overload")
+            self.warn(bot, update, user.id, now)
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Wait for the replies still being sent"""
+        if self._replies:
+            await asyncio.gather(*self._replies, return_exceptions=True)
+
+    def __len__(self) -> int:
+        return len(self._full_at)
@@ -1,16 +1,16 @@
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.utils.keyboard import InlineKeyboardBuilder
-import json
+from datetime import date, datetime
+from catalog import Catalog, get_catalog
+from keyboards import build_days_keyboard, build_slots_keyboard, keyboards
+from slots import SlotIndex
+from outbox import AdminOutbox
+from ledger import AppointmentLedger
+import logging
 import os
 
-# Load data files
-with open('data/translations.json', 'r', encoding='utf-8') as f:
-    translations = json.load(f)
-
-with open('data/services.json', 'r', encoding='utf-8') as f:
-    services = json.load(f)
+logger = logging.getLogger(__name__)
 
 # Load admin ID from environment variable
 try:
@@ -19,26 +19,53 @@ try:
     admin_id_str = admin_id_str.split('#')[0].strip()
     ADMIN_ID = int(admin_id_str)
 except (ValueError, TypeError):
-    print("Warning: Invalid ADMIN_ID in .env file. Admin notifications will be disabled.")
+    logger.warning("Invalid ADMIN_ID in .env file. Admin notifications will be disabled.")
     ADMIN_ID = 0
 
+# Additional admins to notify, comma separated
+ADMIN_IDS = [ADMIN_ID] if ADMIN_ID else []
+for admin_id_str in os.getenv("ADMIN_IDS", "").split('#')[0].split(','):
+    admin_id_str = admin_id_str.strip()
+    if not admin_id_str:
+        continue
+    try:
+        admin_id = int(admin_id_str)
+    except ValueError:
+        logger.warning(f"Invalid admin id {admin_id_str!r} in ADMIN_IDS, skipping it.")
+        continue
+    if admin_id not in ADMIN_IDS:
+        ADMIN_IDS.append(admin_id)
+
+# Appointment notifications are queued and delivered in the background
+admin_outbox = AdminOutbox(ADMIN_IDS)
+
+# Every confirmed appointment is stored for statistics and exports
+appointment_ledger = AppointmentLedger()
+
+# Booked time slots per category, shared by all processes through SQLite
+slot_index = SlotIndex()
+
 class AppointmentStates(StatesGroup):
     waiting_for_name = State()
     waiting_for_phone = State()
     waiting_for_service = State()
+    waiting_for_date = State()
+    waiting_for_time = State()
     waiting_for_confirmation = State()
 
 async def start_appointment(message: types.Message, state: FSMContext, lang: str):
+    translations = get_catalog().translations
     try:
         await message.answer(translations[lang]['enter_name'])
         await state.set_state(AppointmentStates.waiting_for_name)
     except Exception as e:
-        print(f"Error in start_appointment: {e}")
+        logger.error(f"Error in start_appointment: {e}")
         await message.answer(translations[lang]['error_occurred'])
         await state.clear()
 
 async def process_name(message: types.Message, state: FSMContext, lang: str):
     """Process the user's name"""
+    translations = get_catalog().translations
     try:
         # Store the name in state
         await state.update_data(name=message.text)
@@ -60,11 +87,13 @@ async def process_name(message: types.Message, state: FSMContext, lang: str):
         await state.set_state(AppointmentStates.waiting_for_phone)
         
     except Exception as e:
-        print(f"Error in process_name: {e}")
+        logger.error(f"Error in process_name: {e}")
         await message.answer(translations[lang]['error_occurred'])
         await state.clear()
 
 async def process_phone(message: types.Message, state: FSMContext, lang: str):
+    catalog = get_catalog()
+    translations = catalog.translations
     try:
         # Get phone number from message
         if message.contact:
@@ -80,25 +109,6 @@ async def process_phone(message: types.Message, state: FSMContext, lang: str):
         # Store the formatted phone number
         await state.update_data(phone=phone)
         
-        # Create service selection keyboard
-        keyboard = InlineKeyboardBuilder()
-        
-        # Add service buttons in 2 columns
-        for service_id, service in services[lang].items():
-            # Shorten service name if needed
-            service_name = service['name']
-            if len(service_name) > 20:  # Allow slightly longer names
-                service_name = service_name[:20] + "..."
-            
-            keyboard.button(
-                text=service_name,
-                callback_data=f"appointment_service_{service_id}"
-            )
-        
-        # Adjust to 2 columns and add back button
-        keyboard.adjust(2)
-        keyboard.button(text=translations[lang]['back'], callback_data="back_to_main")
-        
         # Remove the contact keyboard
         remove_keyboard = types.ReplyKeyboardRemove()
         
@@ -108,73 +118,210 @@ async def process_phone(message: types.Message, state: FSMContext, lang: str):
             reply_markup=remove_keyboard
         )
         
-        # Send service selection message
+        # Send service selection message: categories first, then their services
         await message.answer(
             text=translations[lang]['select_service'],
-            reply_markup=keyboard.as_markup()
+            reply_markup=keyboards.get('categories', lang, catalog, 0)
         )
         
         # Set state to waiting for service
         await state.set_state(AppointmentStates.waiting_for_service)
         
     except Exception as e:
-        print(f"Error in process_phone: {e}")
+        logger.error(f"Error in process_phone: {e}")
         await message.answer(translations[lang]['error_occurred'])
         await state.clear()
 
-async def process_service_selection(callback: types.CallbackQuery, state: FSMContext, lang: str):
+async def process_service_selection(callback: types.CallbackQuery, state: FSMContext, lang: str, category_id: int, service_id: int):
+    catalog = get_catalog()
+    translations = catalog.translations
+    try:
+        # Buttons of an old category page, search result or finished booking
+        # must not start a booking without the patient's name and phone
+        if (await state.get_state() != AppointmentStates.waiting_for_service.state
+                or not has_contact_details(await state.get_data())):
+            await callback.answer(translations[lang]['error_occurred'])
+            return
+        service = catalog.service(category_id, lang, service_id)
+        if service is None:
+            raise KeyError(f"Unknown service {category_id}/{service_id}")
+        # The category's key, not its position, which a catalog reload may change
+        category = catalog.category(category_id).key
+        await state.update_data(category=category, service_id=service_id)
+
+        # Offer free time slots if the clinic has a schedule; otherwise (or
+        # when everything is booked) admins agree on a time by phone
+        if catalog.schedule is not None and slot_index.free_days(catalog.schedule, category):
+            await show_days(callback, state, lang, catalog)
+            return
+        await confirm_appointment(callback, state, lang, catalog, category, service_id)
+
+    except Exception as e:
+        logger.error(f"Error in process_service_selection: {e}")
+        await callback.answer(translations[lang]['error_occurred'])
+        await state.clear()
+
+async def show_days(callback: types.CallbackQuery, state: FSMContext, lang: str, catalog: Catalog, notice: str = None):
+    """Days with free slots for the chosen service"""
+    data = await state.get_data()
+    category = catalog.category_by_key(data['category'])
+    now = datetime.now()
+    days = slot_index.free_days(catalog.schedule, category.key, now)
+    await callback.message.edit_text(
+        text=catalog.translations[lang]['select_date'],
+        reply_markup=build_days_keyboard(days, now.date(), category.category_id, lang, catalog)
+    )
+    await callback.answer(notice)
+    await state.set_state(AppointmentStates.waiting_for_date)
+
+async def show_slots(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    lang: str,
+    catalog: Catalog,
+    day: date,
+    notice: str = None
+):
+    """Free times of a day, or the days again if none are left"""
+    translations = catalog.translations
+    data = await state.get_data()
+    slots = slot_index.free_slots(catalog.schedule, data['category'], day)
+    if not slots:
+        await show_days(callback, state, lang, catalog, translations[lang]['slot_taken'])
+        return
+    await callback.message.edit_text(
+        text=f"{translations[lang]['select_time']} {day.strftime('%d.%m.%Y')}",
+        reply_markup=build_slots_keyboard(catalog.schedule, day, slots, lang, catalog)
+    )
+    await callback.answer(notice)
+    await state.set_state(AppointmentStates.waiting_for_time)
+
+def has_contact_details(data: dict) -> bool:
+    return bool(data.get('name')) and bool(data.get('phone'))
+
+def has_booking_data(data: dict, catalog: Catalog) -> bool:
+    """False for buttons of a finished or expired appointment, or of a removed category"""
+    return (
+        catalog.schedule is not None
+        and catalog.category_by_key(data.get('category')) is not None
+        and has_contact_details(data)
+    )
+
+async def process_day_selection(callback: types.CallbackQuery, state: FSMContext, lang: str, ordinal: int = None):
+    """Show free times of the day with date ordinal `ordinal`, or the free days when it is None"""
+    catalog = get_catalog()
+    translations = catalog.translations
+    try:
+        if not has_booking_data(await state.get_data(), catalog):
+            await callback.answer(translations[lang]['error_occurred'])
+            return
+        if ordinal is None:
+            await show_days(callback, state, lang, catalog)
+            return
+        day = catalog.schedule.bookable_day(ordinal, date.today())
+        if day is None:
+            # Forged or outdated button
+            await callback.answer(translations[lang]['error_occurred'])
+            return
+        await show_slots(callback, state, lang, catalog, day)
+
+    except Exception as e:
+        logger.error(f"Error in process_day_selection: {e}")
+        await callback.answer(translations[lang]['error_occurred'])
+        await state.clear()
+
+async def process_slot_selection(callback: types.CallbackQuery, state: FSMContext, lang: str, ordinal: int, slot: int):
+    catalog = get_catalog()
+    translations = catalog.translations
     try:
-        # Get the selected service ID from the callback data
-        service_id = callback.data.split('_')[-1]
-        
-        # Get service details
-        service = services[lang][service_id]
-        
-        # Get user data
         data = await state.get_data()
-        name = data.get('name', 'Не указано')
-        phone = data.get('phone', 'Не указан')
-        
-        # Send confirmation to admin
-        admin_message = (
-            f"📝 Новая запись!\n\n"
-            f"👤 Имя: {name}\n"
-            f"📞 Телефон: {phone}\n"
-            f"🏥 Услуга: {service['name']}"
-        )
-        
-        # Send to admin
-        if ADMIN_ID:
-            await callback.bot.send_message(
-                chat_id=ADMIN_ID,
-                text=admin_message
-            )
-        
-        # Send confirmation to user
-        user_message = "✅ Запись подтверждена!\nСкоро администраторы с вами свяжутся."
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(
-            text=translations[lang]['make_another_appointment'],
-            callback_data="make_another_appointment"
+        if not has_booking_data(data, catalog):
+            await callback.answer(translations[lang]['error_occurred'])
+            return
+        # Callback data comes from the client: check it before touching the index
+        day = catalog.schedule.bookable_day(ordinal, date.today())
+        if day is None or not 0 <= slot < catalog.schedule.slots_per_day:
+            await callback.answer(translations[lang]['error_occurred'])
+            return
+        category, service_id = data['category'], data['service_id']
+        booked = await slot_index.reserve(
+            catalog.schedule, category, day, slot, service_id, callback.from_user.id
         )
-        
-        await callback.message.edit_text(
-            text=user_message,
-            reply_markup=keyboard.as_markup()
-        )
-        await callback.answer()
-        
-        # Clear the state
-        await state.clear()
-        
+        if not booked:
+            # Someone else was faster: show what is still free that day
+            await show_slots(callback, state, lang, catalog, day, translations[lang]['slot_taken'])
+            return
+        when = f"{day.strftime('%d.%m.%Y')} {catalog.schedule.slot_time(slot)}"
+        await confirm_appointment(callback, state, lang, catalog, category, service_id, when)
+
     except Exception as e:
-        print(f"Error in process_service_selection: {e}")
+        logger.error(f"Error in process_slot_selection: {e}")
         await callback.answer(translations[lang]['error_occurred'])
         await state.clear()
 
+async def confirm_appointment(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    lang: str,
+    catalog: Catalog,
+    category: str,
+    service_id: int,
+    when: str = None
+):
+    found = catalog.category_by_key(category)
+    category_id = found.category_id if found is not None else None
+    service = catalog.service(category_id, lang, service_id) if found is not None else None
+    if service is None:
+        raise KeyError(f"Unknown service {category}/{service_id}")
+
+    # Get user data
+    data = await state.get_data()
+    if not has_contact_details(data):
+        raise ValueError("Appointment without name or phone")
+    name = data['name']
+    phone = data['phone']
+
+    # Send confirmation to admin
+    admin_message = (
+        f"📝 Новая запись!\n\n"
+        f"👤 Имя: {name}\n"
+        f"📞 Телефон: {phone}\n"
+        f"🏥 Услуга: {service.name}\n"
+        f"💰 Цена: {service.price}"
+    )
+    if when:
+        admin_message += f"\n🕒 Время: {when}"
+
+    # Queue for the admins; delivery happens in the background
+    await admin_outbox.enqueue(admin_message)
+
+    # Store in the ledger under the service name of the main language
+    ledger_service = catalog.service(category_id, catalog.languages[0], service_id) or service
+    appointment_ledger.record(
+        user_id=callback.from_user.id,
+        name=name,
+        phone=phone,
+        category_id=category_id,
+        service_id=service_id,
+        service=ledger_service.name,
+        price=ledger_service.price,
+        lang=lang
+    )
+
+    # Send confirmation to user
+    if when:
+        user_message = f"✅ Запись подтверждена!\n🕒 {when}"
+    else:
+        user_message = "✅ Запись подтверждена!\nСкоро администраторы с вами свяжутся."
+    await callback.message.edit_text(
+        text=user_message,
+        reply_markup=keyboards.get('appointment_done', lang, catalog)
+    )
+    await callback.answer()
+
+    # Clear the state
+    await state.clear()
+
 def get_confirmation_keyboard(lang: str):
     """Create keyboard for appointment confirmation"""
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text=translations[lang]['make_another_appointment'], callback_data="make_another_appointment")
-    keyboard.button(text=translations[lang]['back_to_main'], callback_data="back_to_main")
-    return keyboard.as_markup() 
\ No newline at end of file
+    return keyboards.get('confirmation', lang)
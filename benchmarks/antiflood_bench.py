@@ -0,0 +1,197 @@
+"""Cost of flood control per update.
+
+Updates are checked by Antiflood before a handler that does nothing, and
+the time per update is compared with calling the handler directly. Replies
+("please wait", answers to repeated button taps) go to a bot session that
+answers every call at once, so their aiogram side is included but no
+network. The last scenario feeds updates to a SchedulingDispatcher whose
+only slot is busy, to show that dropped updates wait for nothing. Also
+reports the memory of the per-user table and how it empties once users go
+idle.
+
+Run from the repository root:
+
+    python -m benchmarks.antiflood_bench --updates 100000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+
+
+class NullSession(BaseSession):
+    """Answers every Bot API call immediately"""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def message_update(bot, update_id, user_id, text="hello"):
+    user = {"id": user_id, "is_bot": False, "first_name": "Patient"}
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": user,
+        },
+    }, context={"bot": bot})
+
+
+def callback_update(bot, update_id, user_id, data="video"):
+    user = {"id": user_id, "is_bot": False, "first_name": "Patient"}
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": data, "from": user,
+            "message": {
+                "message_id": 1, "date": 0, "text": "menu",
+                "chat": {"id": user_id, "type": "private"}, "from": user,
+            },
+        },
+    }, context={"bot": bot})
+
+
+async def handler(event, data):
+    return None
+
+
+async def feed(bot, antiflood, updates):
+    started = time.perf_counter()
+    for update in updates:
+        if antiflood is None or antiflood.check(bot, update):
+            await handler(update, {})
+    if antiflood is not None:
+        # Replies to dropped updates are part of the cost
+        await antiflood.close()
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def shed_while_busy(bot, antiflood, updates):
+    """Seconds per update dropped by a dispatcher whose only slot is taken"""
+    from scheduler import SchedulingDispatcher, UpdateScheduler
+
+    scheduler = UpdateScheduler(max_concurrency=1)
+    antiflood.shed_depth = 0
+    antiflood.depth = lambda: scheduler.queued - scheduler.running
+    dp = SchedulingDispatcher(scheduler, gate=antiflood.check)
+    release = asyncio.Event()
+
+    @dp.message()
+    async def busy(message):
+        await release.wait()
+
+    # One update holds the slot, another one waits for it
+    blocking = [asyncio.create_task(dp.feed_update(bot, message_update(bot, i, i + 1))) for i in range(2)]
+    while scheduler.queued < 2:
+        await asyncio.sleep(0)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    per_update = (time.perf_counter() - started) / len(updates)
+    release.set()
+    await asyncio.gather(*blocking)
+    await antiflood.close()
+    return per_update
+
+
+async def run(args):
+    from antiflood import Antiflood, dropped_total
+    from language_store import LanguageStore, SQLiteLanguageBackend
+
+    bot = Bot(token="123456:ANTIFLOOD", session=NullSession())
+    store = LanguageStore(SQLiteLanguageBackend())
+    n = args.updates
+    depth = {"value": 0}
+
+    def antiflood():
+        return Antiflood(
+            store, rate=args.rate, burst=args.burst, shed_depth=args.shed_depth, depth=lambda: depth["value"]
+        )
+
+    distinct = [message_update(bot, i, 10 ** 6 + i) for i in range(n)]
+    scenarios = [
+        ("distinct users", distinct),
+        ("one user flooding messages", [message_update(bot, i, 42) for i in range(n)]),
+        ("one user repeating a button", [callback_update(bot, i, 42) for i in range(n)]),
+    ]
+    baseline = await feed(bot, None, distinct)
+    print(f"{n} updates, rate {args.rate}/s, burst {args.burst}\n")
+    print(f"{'scenario':<32}{'us/update':>10}{'overhead':>10}{'handled':>9}{'dropped':>9}")
+    print(f"{'no flood control':<32}{baseline * 1e6:>10.2f}{'':>10}{n:>9}{0:>9}")
+    try:
+        for name, updates in scenarios:
+            before = sum(dropped_total.values.values())
+            per_update = await feed(bot, antiflood(), updates)
+            dropped = int(sum(dropped_total.values.values()) - before)
+            print(f"{name:<32}{per_update * 1e6:>10.2f}{(per_update - baseline) * 1e6:>10.2f}{n - dropped:>9}{dropped:>9}")
+
+        # Overloaded: every update of a new user is answered "please wait"
+        depth["value"] = args.shed_depth + 1
+        shed = distinct[:args.overload_updates]
+        before = sum(dropped_total.values.values())
+        per_update = await feed(bot, antiflood(), shed)
+        dropped = int(sum(dropped_total.values.values()) - before)
+        depth["value"] = 0
+        print(f"{'overloaded, new users':<32}{per_update * 1e6:>10.2f}{(per_update - baseline) * 1e6:>10.2f}"
+              f"{len(shed) - dropped:>9}{dropped:>9}")
+        before = sum(dropped_total.values.values())
+        per_update = await shed_while_busy(bot, antiflood(), shed)
+        dropped = int(sum(dropped_total.values.values()) - before)
+        print(f"{'overloaded, via dispatcher':<32}{per_update * 1e6:>10.2f}{(per_update - baseline) * 1e6:>10.2f}"
+              f"{len(shed) - dropped:>9}{dropped:>9}")
+
+        # Memory of the table with every user active at once, and after they went idle
+        table = antiflood()
+        now = time.monotonic()
+        tracemalloc.start()
+        for user_id in range(10 ** 6, 10 ** 6 + n):
+            table.allow(user_id, now)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        active = len(table)
+        idle_at = now + args.burst / args.rate + 1
+        passes = 0
+        while len(table):
+            table._prune(idle_at)
+            passes += 1
+        print(f"\ntable of {active} active users: {memory / 2 ** 20:.1f} MiB ({memory / active:.0f} bytes per user)")
+        print(f"emptied {args.burst / args.rate:.0f}s after the last update, over {passes} later updates")
+    finally:
+        await store.close()
+        await bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=100000)
+    parser.add_argument("--overload-updates", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=2.0, help="updates per second per user")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--shed-depth", type=int, default=500)
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix="medbot-antiflood-")
+    os.environ["STATE_DIR"] = state_dir
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Broadcast throughput and resuming after a restart.
+
+Known users are created in a temporary language store, a part of them
+having blocked the bot, and one broadcast is sent through the fake Bot API
+from benchmarks.loadtest. Halfway through, the sender is stopped the way a
+restart would stop it and a new one picks the job up from its checkpoint;
+the report shows how many users got the message twice.
+
+Run from the repository root:
+
+    python -m benchmarks.broadcast_bench --users 20000 --api-latency 20
+    python -m benchmarks.broadcast_bench --users 600 --global-rate 30
+
+The default global rate is far above Telegram's ~30 messages per second, to
+measure the engine itself; pass --global-rate 30 to see real pacing.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.loadtest import FakeBotAPI
+
+
+async def wait_for(broadcaster, status_check, timeout=3600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await broadcaster.latest()
+        if job and status_check(job):
+            return job
+        await asyncio.sleep(0.05)
+    raise TimeoutError("broadcast did not finish")
+
+
+async def run(args, state_dir):
+    from aiogram import Bot
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from broadcast import Broadcaster, render
+    from catalog import get_catalog
+    from language_store import LanguageStore, SQLiteLanguageBackend
+    from ratelimit import RateLimiter
+    from session import BotSession
+
+    random.seed(args.seed)
+    backend = SQLiteLanguageBackend()
+    user_ids = random.sample(range(10 ** 6, 10 ** 10), args.users)
+    languages = list(get_catalog().languages)
+    # Most users picked a language, some only pressed /start
+    backend.add_users(user_ids)
+    backend.save_many([(user_id, random.choice(languages)) for user_id in user_ids if random.random() < 0.9])
+    store = LanguageStore(backend)
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    api.blocked = set(random.sample(user_ids, int(args.users * args.blocked)))
+    await api.start()
+    session = BotSession(api=TelegramAPIServer.from_base(api.base_url))
+    bot = Bot(token="123456:BROADCAST", session=session)
+    bot.session.middleware(RateLimiter(global_rate=args.global_rate, per_chat_rate=1))
+    path = os.path.join(state_dir, "broadcasts.sqlite3")
+
+    chunk_started = time.perf_counter()
+    chunk = await store.users(limit=args.chunk_size)
+    chunk_read = time.perf_counter() - chunk_started
+    assert len(chunk) == min(args.chunk_size, args.users)
+
+    try:
+        broadcaster = Broadcaster(store, path, chunk_size=args.chunk_size, concurrency=args.concurrency)
+        job_id = await broadcaster.create(0, render(get_catalog().translations, "welcome"))
+        started = time.perf_counter()
+        await broadcaster.start(bot)
+        # Restart halfway through
+        job = await wait_for(broadcaster, lambda j: j['cursor'] and j['sent'] + j['blocked'] >= args.users // 2)
+        await broadcaster.close()
+        print(f"stopped after {job['sent'] + job['blocked'] + job['failed']} users (checkpoint)")
+
+        broadcaster = Broadcaster(store, path, chunk_size=args.chunk_size, concurrency=args.concurrency)
+        await broadcaster.start(bot)
+        job = await wait_for(broadcaster, lambda j: j['status'] != 'running')
+        wall = time.perf_counter() - started
+        await broadcaster.close()
+    finally:
+        await store.close()
+        await bot.session.close()
+        await api.close()
+
+    attempts = api.calls["sendMessage"]
+    done = job['sent'] + job['blocked'] + job['failed']
+    print(f"broadcast #{job_id}: {job['status']}, {args.users} users")
+    print(f"  sent {job['sent']}, blocked {job['blocked']}, failed {job['failed']}")
+    print(f"  {done / job['elapsed']:.0f} users/s while sending, {wall:.1f}s wall clock including the restart")
+    print(f"  messages sent twice after the restart: {attempts - args.users} (chunk size {args.chunk_size})")
+    print(f"  reading a chunk of {args.chunk_size} users: {chunk_read * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--blocked", type=float, default=0.05, help="share of users who blocked the bot")
+    parser.add_argument("--api-latency", type=float, default=20.0, help="delay of every fake Bot API call, ms")
+    parser.add_argument("--global-rate", type=float, default=100000.0, help="messages per second for the whole bot")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix="medbot-broadcast-")
+    os.environ["STATE_DIR"] = state_dir
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        asyncio.run(run(args, state_dir))
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
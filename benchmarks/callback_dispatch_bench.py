@@ -0,0 +1,83 @@
+"""Dispatch cost of CallbackRouter versus a chain of lambda filters.
+
+The lambda chain mirrors the old `@dp.callback_query(lambda c: ...)` handlers:
+each callback is tested against every predicate until one matches. The
+worst case (the last registered handler) is measured for each handler count.
+
+Run from the repository root:
+
+    python -m benchmarks.callback_dispatch_bench
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from aiogram.filters.callback_data import CallbackData
+
+from callbacks import CallbackRouter
+
+
+class ItemCallback(CallbackData, prefix="item"):
+    item_id: str
+
+
+async def handler(callback, callback_data=None):
+    return callback_data
+
+
+def build_lambda_chain(count):
+    chain = []
+    for i in range(count):
+        if i % 2:
+            chain.append((lambda c, i=i: c.data.startswith(f"p{i}_"), handler))
+        else:
+            chain.append((lambda c, i=i: c.data == f"exact{i}", handler))
+    chain.append((lambda c: c.data.startswith("item_"), handler))
+    return chain
+
+
+async def dispatch_chain(chain, callback):
+    for predicate, func in chain:
+        if predicate(callback):
+            return await func(callback, callback.data.split('_')[1])
+
+
+def build_router(count):
+    router = CallbackRouter()
+    for i in range(count):
+        if i % 2:
+            factory = type(f"P{i}", (CallbackData,), {"__annotations__": {"value": str}}, prefix=f"p{i}")
+            router.route(factory)(handler)
+        else:
+            router.exact(f"exact{i}")(handler)
+    router.route(ItemCallback)(handler)
+    return router
+
+
+async def time_it(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    state = SimpleNamespace()
+    print(f"{'handlers':>9} {'lambda chain, us':>17} {'router, us':>11}")
+    for count in (5, 10, 50, 100, 500, 1000):
+        chain = build_lambda_chain(count)
+        router = build_router(count)
+        legacy = SimpleNamespace(data="item_42")
+        packed = SimpleNamespace(data=ItemCallback(item_id="42").pack())
+        chain_us = await time_it(lambda: dispatch_chain(chain, legacy), args.iterations)
+        router_us = await time_it(lambda: router.dispatch(packed, state), args.iterations)
+        print(f"{count:>9} {chain_us:>17.2f} {router_us:>11.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
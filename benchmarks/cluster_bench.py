@@ -0,0 +1,124 @@
+"""Throughput of cluster.py with different numbers of worker processes.
+
+Workers are real `main.py` processes talking to the fake Bot API from
+benchmarks.loadtest. Synthetic patients go through the whole appointment
+flow, up to a free time slot of their own, so no booking fails because
+another patient took the slot. Choosing the service, the day and the time
+each edit the message (editMessageText); a run is done when every patient
+got all three, the last one being the booking confirmation. Throughput can
+only grow with the number of workers up to the number of CPU cores.
+
+Run from the repository root:
+
+    python -m benchmarks.cluster_bench --workers 1 2 4 --users 200 --api-latency 20
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.loadtest import FakeBotAPI, UpdateFactory
+from cluster import UpdateRouter, WorkerPool
+
+# Message edits of a booking: days, times, confirmation
+EDITS_PER_BOOKING = 3
+
+
+def free_bookings(catalog):
+    """(service callback, day, slot) of every slot from tomorrow on, one service per category"""
+    from slots import slot_bits
+
+    schedule = catalog.schedule
+    tomorrow = date.today() + timedelta(days=1)
+    bookings = []
+    for category in catalog.categories:
+        service = category.services["ru"][0]
+        for day in schedule.days(tomorrow)[:schedule.days_ahead - 1]:
+            for slot in slot_bits(schedule.working(day)):
+                bookings.append((f"service:{service.category_id}:{service.service_id}", day, slot))
+    return bookings
+
+
+def appointment_flow(user_id, booking):
+    service_data, day, slot = booking
+    factory = UpdateFactory(user_id)
+    return [
+        factory.message("/start"),
+        factory.callback("lang:ru"),
+        factory.callback("start_appointment"),
+        factory.message("Test Patient"),
+        factory.message("+998991234567"),
+        factory.callback(service_data),
+        factory.callback(f"day:{day.toordinal()}"),
+        factory.callback(f"slot:{day.toordinal()}:{slot}"),
+    ]
+
+
+async def run(workers, users, api_latency, base_port):
+    from catalog import get_catalog
+
+    bookings = free_bookings(get_catalog())
+    if users > len(bookings):
+        raise SystemExit(f"--users is over the {len(bookings)} free slots of the schedule")
+
+    state_dir = tempfile.mkdtemp(prefix="medbot-cluster-")
+    api = FakeBotAPI(latency=api_latency / 1000)
+    await api.start()
+    env = dict(os.environ)
+    for name in ("METRICS_PORT", "MEDIA_PREWARM", "REDIS_URL"):
+        env.pop(name, None)
+    env.update(
+        BOT_TOKEN="123456:CLUSTER", BOT_API_URL=api.base_url, STATE_DIR=state_dir, ADMIN_ID="0",
+        MAX_CONCURRENT_UPDATES="256", WEBHOOK_MAX_IN_FLIGHT="256",
+        # Measure the bot, not Telegram's flood limits
+        RATE_LIMIT_GLOBAL="100000", RATE_LIMIT_PER_CHAT="1000",
+        ANTIFLOOD_RATE="1000", SHED_QUEUE_DEPTH=str(10 ** 6),
+        # Per-update info lines would drown the results
+        LOG_LEVEL="WARNING"
+    )
+    pool = WorkerPool(workers, base_port=base_port, env=env)
+    router = UpdateRouter(pool.urls, pool.secret)
+    await pool.start()
+    await router.start()
+    try:
+        await pool.wait_ready()
+        flows = [appointment_flow(10 ** 6 + i, bookings[i]) for i in range(users)]
+        # Step by step across all patients, like many people using the bot at once
+        updates = [flow[step] for step in range(len(flows[0])) for flow in flows]
+        started = time.perf_counter()
+        for update in updates:
+            await router.submit(update)
+        while api.calls["editMessageText"] < users * EDITS_PER_BOOKING:
+            if time.perf_counter() - started > 600:
+                done = api.calls["editMessageText"] // EDITS_PER_BOOKING
+                raise TimeoutError(f"only about {done} of {users} appointments finished")
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        return len(updates), elapsed, list(router.forwarded)
+    finally:
+        await router.close()
+        await pool.close()
+        await api.close()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200, help="at most one per free slot of the schedule")
+    parser.add_argument("--api-latency", type=float, default=20.0, help="delay of every fake Bot API call, ms")
+    parser.add_argument("--base-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    print(f"{args.users} patients, full appointment flow, {os.cpu_count()} CPU cores\n")
+    print(f"{'workers':>8}{'updates/s':>12}{'seconds':>10}  updates per worker")
+    for workers in args.workers:
+        count, elapsed, forwarded = asyncio.run(run(workers, args.users, args.api_latency, args.base_port))
+        print(f"{workers:>8}{count / elapsed:>12.0f}{elapsed:>10.2f}  {forwarded}")
+
+
+if __name__ == "__main__":
+    main()
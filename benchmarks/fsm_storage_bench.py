@@ -0,0 +1,83 @@
+"""Compare SQLiteStorage with aiogram's MemoryStorage on the appointment flow.
+
+Run from the repository root:
+
+    python -m benchmarks.fsm_storage_bench --users 2000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+
+STATES = (
+    "AppointmentStates:waiting_for_name",
+    "AppointmentStates:waiting_for_phone",
+    "AppointmentStates:waiting_for_service",
+)
+
+
+async def run_flow(storage, key, flush):
+    # One update per step, mirroring start_appointment/process_name/process_phone
+    await storage.get_state(key)
+    await storage.set_state(key, STATES[0])
+    await flush()
+
+    await storage.get_state(key)
+    await storage.update_data(key, {"name": "Test Patient"})
+    await storage.set_state(key, STATES[1])
+    await flush()
+
+    await storage.get_state(key)
+    await storage.update_data(key, {"phone": "+998991234567"})
+    await storage.set_state(key, STATES[2])
+    await flush()
+
+    await storage.get_state(key)
+    await storage.get_data(key)
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+    await flush()
+
+
+async def bench(name, storage, users, concurrency, flush):
+    keys = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(users)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(key):
+        async with semaphore:
+            await run_flow(storage, key, flush)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(key) for key in keys))
+    elapsed = time.perf_counter() - start
+    updates = users * 4
+    print(f"{name:<14} {users} flows, {updates} updates in {elapsed:.3f}s -> {updates / elapsed:,.0f} updates/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    memory = MemoryStorage()
+
+    async def no_flush():
+        pass
+
+    await bench("MemoryStorage", memory, args.users, args.concurrency, no_flush)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteStorage(path=os.path.join(tmp, "fsm.sqlite3"))
+        await bench("SQLiteStorage", sqlite, args.users, args.concurrency, sqlite.flush)
+        await sqlite.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
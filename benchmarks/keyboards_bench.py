@@ -0,0 +1,56 @@
+"""Per-update CPU spent on keyboards: building with InlineKeyboardBuilder versus KeyboardRegistry.
+
+Each "update" produces one main menu, one contacts keyboard and one
+confirmation keyboard, like the handlers in main.py and appointment.py.
+
+Run from the repository root:
+
+    python -m benchmarks.keyboards_bench
+"""
+import argparse
+import time
+
+from catalog import get_catalog
+from keyboards import (
+    build_confirmation_keyboard,
+    build_contacts_keyboard,
+    build_main_menu_keyboard,
+    keyboards,
+)
+
+SCREENS = (
+    ('main_menu', build_main_menu_keyboard),
+    ('contacts', build_contacts_keyboard),
+    ('confirmation', build_confirmation_keyboard),
+)
+
+
+def bench(label, func, updates):
+    start = time.process_time()
+    for i in range(updates):
+        func('ru' if i % 2 else 'uz')
+    elapsed = time.process_time() - start
+    print(f"{label:<22} {elapsed / updates * 1e6:8.2f} us CPU per update")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    catalog = get_catalog()
+
+    def rebuild(lang):
+        for _, builder in SCREENS:
+            builder(lang, catalog)
+
+    def cached(lang):
+        for screen, _ in SCREENS:
+            keyboards.get(screen, lang, catalog)
+
+    bench("InlineKeyboardBuilder", rebuild, args.updates)
+    bench("KeyboardRegistry", cached, args.updates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""Load test of the real dispatcher from main.py against a fake Telegram Bot API.
+
+A local aiohttp server stands in for api.telegram.org and answers every
+method the bot uses (sendMessage, sendVideo, editMessageText, ...) with a
+plausible result, recording what was called. Synthetic patients then go
+through /start, language selection, the contacts menu and the whole
+appointment flow, and every update is fed to `main.dp` the same way polling
+does. State is kept in a temporary directory, never in data/state.
+
+Run from the repository root:
+
+    python -m benchmarks.loadtest --users 500 --rate 100 --api-latency 20
+    python -m benchmarks.loadtest --users 2000 --rate 0 --json results.json
+
+--rate is the number of new patients per second (0 starts them all at once),
+--think the pause between two steps of one patient.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+VIDEO_FILE = {
+    "file_id": "loadtest-video",
+    "file_unique_id": "loadtest-video",
+    "width": 1280,
+    "height": 720,
+    "duration": 30,
+}
+
+
+class FakeBotAPI:
+    """Minimal Bot API server that records every call"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.first_call = {}
+        self.updates = []
+        # Chats that blocked the bot get 403 Forbidden
+        self.blocked = set()
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.base_url = None
+
+    def _message(self, chat_id, **extra):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **extra,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await request.post()
+        self.calls[method] += 1
+        self.first_call.setdefault(method, time.perf_counter())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        name = method.lower()
+        chat_id = params.get("chat_id", 0)
+        if chat_id and int(chat_id) in self.blocked:
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                status=403
+            )
+        if name == "getme":
+            result = {"id": 123456, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot"}
+        elif name == "sendvideo":
+            result = self._message(chat_id, video=VIDEO_FILE)
+        elif name in ("sendmessage", "sendlocation", "editmessagetext"):
+            result = self._message(chat_id)
+        elif name == "getupdates":
+            # Hand out queued updates, otherwise hold the long poll briefly
+            result, self.updates = self.updates, []
+            if not result:
+                await asyncio.sleep(min(float(params.get("timeout", 0)), 1.0))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class UpdateFactory:
+    """Builds raw updates for one synthetic patient"""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"Patient {user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def message(self, text: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": random.randint(1, 10 ** 6),
+                "date": int(time.time()),
+                "chat": self.chat,
+                "from": self.user,
+                "text": text,
+            },
+        }
+
+    def callback(self, data: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self.user,
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": {
+                    "message_id": random.randint(1, 10 ** 6),
+                    "date": int(time.time()),
+                    "chat": self.chat,
+                    "text": "menu",
+                },
+            },
+        }
+
+
+def build_scenarios(catalog):
+    """(name, weight, steps) where a step is (label, kind, payload-builder)"""
+    services = {lang: catalog.price_list(lang) for lang in catalog.languages}
+
+    def service_choice(lang):
+        service = random.choice(services[lang])
+        return f"service:{service.category_id}:{service.service_id}"
+
+    def category_choice():
+        return f"sp:{random.randrange(len(catalog.categories))}:0"
+
+    def slot_steps():
+        # A working day from tomorrow on, so the booking lead time never matters
+        from slots import slot_bits
+
+        schedule = catalog.schedule
+        if schedule is None:
+            return []
+        tomorrow = date.today() + timedelta(days=1)
+        days = [day for day in schedule.days(tomorrow)[:schedule.days_ahead - 1] if schedule.working(day)]
+        if not days:
+            return []
+        day = random.choice(days)
+        slot = random.choice(slot_bits(schedule.working(day)))
+        return [
+            ("day", "callback", f"day:{day.toordinal()}"),
+            ("slot", "callback", f"slot:{day.toordinal()}:{slot}"),
+        ]
+
+    def onboarding(lang):
+        return [
+            ("start", "message", "/start"),
+            ("language", "callback", f"lang:{lang}"),
+        ]
+
+    def browse(lang):
+        return onboarding(lang) + [
+            ("about", "callback", "about_clinic"),
+            ("back", "callback", "back_to_main"),
+        ]
+
+    def contacts(lang):
+        return onboarding(lang) + [
+            ("contacts", "callback", "show_contacts"),
+            ("contact_call", "callback", "contact:call"),
+            ("contact_location", "callback", "contact:location"),
+            ("contact_video", "callback", "contact:video"),
+            ("back", "callback", "back_to_main"),
+        ]
+
+    def appointment(lang):
+        return onboarding(lang) + [
+            ("appointment", "callback", "start_appointment"),
+            ("name", "message", "Test Patient"),
+            ("phone", "message", "+998 99 123 45 67"),
+            ("category", "callback", category_choice()),
+            ("service", "callback", service_choice(lang)),
+        ] + slot_steps()
+
+    def search(lang):
+        service = random.choice(services[lang])
+        return onboarding(lang) + [
+            ("search", "message", f"/search {service.name}"),
+            ("appointment", "callback", "start_appointment"),
+            ("name", "message", "Test Patient"),
+            ("phone", "message", "+998 99 123 45 67"),
+            ("search_service", "message", service.name.split()[0]),
+            ("service", "callback", service_choice(lang)),
+        ] + slot_steps()
+
+    return [
+        ("appointment", 5, appointment),
+        ("search", 2, search),
+        ("contacts", 3, contacts),
+        ("browse", 2, browse),
+    ]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+async def run_patient(dp, bot, user_id, steps, think, latencies, errors):
+    from aiogram.types import Update
+
+    factory = UpdateFactory(user_id)
+    for label, kind, payload in steps:
+        raw = factory.message(payload) if kind == "message" else factory.callback(payload)
+        update = Update.model_validate(raw, context={"bot": bot})
+        await dp.scheduler.admit()
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            errors[f"{label}: {type(e).__name__}: {e}"] += 1
+        latencies[label].append(time.perf_counter() - started)
+        if think:
+            await asyncio.sleep(random.uniform(0, 2 * think))
+
+
+async def run(args):
+    state_dir = tempfile.mkdtemp(prefix="medbot-loadtest-")
+    os.environ["STATE_DIR"] = state_dir
+    os.environ["BOT_TOKEN"] = "123456:LOADTEST"
+    os.environ.pop("METRICS_PORT", None)
+    # Scripted patients tap faster than people; keep flood control on but out of the way
+    os.environ["ANTIFLOOD_RATE"] = "1000"
+    os.environ["SHED_QUEUE_DEPTH"] = str(10 ** 6)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    import main
+    from aiogram import Bot
+    from aiogram.client.telegram import TelegramAPIServer
+    from catalog import get_catalog
+    from media_cache import MediaCache
+    from session import BotSession
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Fake file_ids must not end up in the real cache
+    main.media_cache = MediaCache(os.path.join(state_dir, "media_cache.json"))
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+    session = BotSession(api=TelegramAPIServer.from_base(api.base_url))
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    if args.rate_limit:
+        bot.session.middleware(main.rate_limiter)
+    dp = main.dp
+
+    random.seed(args.seed)
+    scenarios = build_scenarios(get_catalog())
+    names = [name for name, _, _ in scenarios]
+    weights = [weight for _, weight, _ in scenarios]
+    builders = {name: build for name, _, build in scenarios}
+    languages = list(get_catalog().languages)
+
+    latencies = defaultdict(list)
+    errors = Counter()
+    started_scenarios = Counter()
+
+    await dp.emit_startup(bot=bot, bots=[bot], dispatcher=dp, **dp.workflow_data)
+    gc.collect()
+    started = time.perf_counter()
+    try:
+        tasks = []
+        for i in range(args.users):
+            name = random.choices(names, weights)[0]
+            started_scenarios[name] += 1
+            steps = builders[name](random.choice(languages))
+            tasks.append(asyncio.create_task(
+                run_patient(dp, bot, 10 ** 6 + i, steps, args.think, latencies, errors)
+            ))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    finally:
+        await dp.emit_shutdown(bot=bot, bots=[bot], dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+        await api.close()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    results = {
+        "users": args.users,
+        "scenarios": dict(started_scenarios),
+        "updates": len(all_latencies),
+        "elapsed_s": elapsed,
+        "throughput_updates_per_s": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            label: {
+                "count": len(values),
+                "p50": percentile(values, 0.50) * 1000,
+                "p99": percentile(values, 0.99) * 1000,
+                "max": max(values) * 1000,
+            }
+            for label, values in sorted(latencies.items())
+        },
+        "overall_ms": {
+            "p50": percentile(all_latencies, 0.50) * 1000,
+            "p99": percentile(all_latencies, 0.99) * 1000,
+        },
+        "api_calls": dict(api.calls),
+        "errors": dict(errors),
+        "scheduler": dp.scheduler.snapshot(),
+    }
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        results["tracemalloc_peak_mb"] = peak / 2 ** 20
+        tracemalloc.stop()
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results["max_rss_mb"] = maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    return results
+
+
+def report(results):
+    print(f"\n{results['users']} patients, {results['updates']} updates in {results['elapsed_s']:.2f}s "
+          f"({results['throughput_updates_per_s']:.0f} updates/s)")
+    print("scenarios: " + ", ".join(f"{k}={v}" for k, v in results["scenarios"].items()))
+    print(f"\n{'step':<18}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, row in results["latency_ms"].items():
+        print(f"{label:<18}{row['count']:>8}{row['p50']:>10.2f}{row['p99']:>10.2f}{row['max']:>10.2f}")
+    overall = results["overall_ms"]
+    print(f"{'all':<18}{results['updates']:>8}{overall['p50']:>10.2f}{overall['p99']:>10.2f}")
+    print("\nBot API calls: " + ", ".join(f"{k}={v}" for k, v in sorted(results["api_calls"].items())))
+    if "max_rss_mb" in results:
+        print(f"max RSS: {results['max_rss_mb']:.1f} MiB")
+    if "tracemalloc_peak_mb" in results:
+        print(f"tracemalloc peak: {results['tracemalloc_peak_mb']:.1f} MiB")
+    if results["errors"]:
+        print("\nerrors:")
+        for error, count in results["errors"].items():
+            print(f"  {count} x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500, help="number of synthetic patients")
+    parser.add_argument("--rate", type=float, default=100.0, help="new patients per second, 0 for all at once")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between steps of one patient, seconds")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="delay of every fake Bot API call, ms")
+    parser.add_argument("--rate-limit", action="store_true", help="send through the bot's outbound rate limiter")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="also report Python heap peak (slower)")
+    parser.add_argument("--json", help="write the results to this file for comparison between runs")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Event loop stalls caused by writing logs.
+
+Bursts of updates go through LogContextMiddleware to a handler that logs an
+error, as handlers do when a Bot API call fails; with the per-update info
+line that makes two records per update. The log output is a pipe read at
+`--sink-kbps`, like a slow terminal or log collector: once the pipe is
+full, every write waits for the reader.
+
+Three setups are compared: the previous one (a StreamHandler writing on
+the event loop thread), the queue with a writer thread from logs.py, and
+the queue with 10% sampling of the per-update info lines. Reported are the
+time the event loop spent inside logging calls, the worst delay of a 1 ms
+timer running next to the updates, and how long the writer needed to catch
+up after the last burst.
+
+Run from the repository root:
+
+    python -m benchmarks.logging_bench --bursts 5 --burst-size 1000 --sink-kbps 500
+"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from aiogram.types import Update
+
+from benchmarks.loadtest import percentile
+from logs import LogContextMiddleware, set_handler, setup_logging
+
+
+class SlowPipe:
+    """A pipe drained by a thread at a fixed rate"""
+
+    def __init__(self, kbps):
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'rb', buffering=0)
+        self.writer = os.fdopen(write_fd, 'w', encoding='utf-8', buffering=1)
+        self.chunk = 4096
+        self.delay = self.chunk / (kbps * 1024)
+        self.received = 0
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            data = self.reader.read(self.chunk)
+            if not data:
+                break
+            self.received += data.count(b"\n")
+            time.sleep(self.delay)
+
+    def close(self):
+        self.writer.close()
+        self.thread.join()
+        self.reader.close()
+
+
+def make_update(update_id):
+    user = {"id": 10 ** 6 + update_id, "is_bot": False, "first_name": "Patient"}
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "Ivan",
+            "chat": {"id": user["id"], "type": "private"}, "from": user,
+        },
+    })
+
+
+async def heartbeat(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run_bursts(args, updates):
+    middleware = LogContextMiddleware()
+    log = logging.getLogger('appointment')
+
+    async def handler(event, data):
+        set_handler('process_name')
+        await asyncio.sleep(0)
+        log.error(f"Error in process_name: Telegram server says - Bad Request: message to edit not found "
+                  f"(update {event.update_id})")
+
+    async def feed(update):
+        # The info line is written by the middleware after the handler
+        await middleware(handler, update, {"event_from_user": update.message.from_user})
+
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    started = time.perf_counter()
+    for burst in range(args.bursts):
+        chunk = updates[burst * args.burst_size:(burst + 1) * args.burst_size]
+        await asyncio.gather(*(feed(update) for update in chunk))
+        await asyncio.sleep(args.pause)
+    handled = time.perf_counter() - started
+    stop.set()
+    await beat
+    return handled, sorted(lags)
+
+
+def measure(name, args, updates, configure):
+    pipe = SlowPipe(args.sink_kbps)
+    root = logging.getLogger()
+    listener, handler = configure(pipe.writer)
+    handled, lags = asyncio.run(run_bursts(args, updates))
+    started = time.perf_counter()
+    if listener is not None:
+        listener.stop()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    pipe.close()
+    drained = time.perf_counter() - started
+    dropped = getattr(handler, 'dropped', 0)
+    print(
+        f"{name:<24}{handler.calls_time * 1000:>11.0f}{percentile(lags, 0.99) * 1000:>10.1f}"
+        f"{lags[-1] * 1000:>10.1f}{handled:>9.2f}{drained:>9.2f}{pipe.received:>9}{dropped:>9}"
+    )
+
+
+class TimedHandlerMixin:
+    """Adds up the time spent in handle(), which runs on the caller's thread"""
+
+    calls_time = 0.0
+
+    def handle(self, record):
+        started = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            self.calls_time += time.perf_counter() - started
+
+
+class TimedStreamHandler(TimedHandlerMixin, logging.StreamHandler):
+    pass
+
+
+def stream_setup(stream):
+    handler = TimedStreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    return None, handler
+
+
+def queue_setup(sample_rate):
+    def configure(stream):
+        listener = setup_logging(stream=stream, sample_rate=sample_rate)
+        handler = logging.getLogger().handlers[0]
+        # Time the queue handler the same way as the stream handler
+        handler.__class__ = type('TimedQueueHandler', (TimedHandlerMixin, handler.__class__), {})
+        return listener, handler
+    return configure
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=1000, help="updates arriving at once")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds between bursts")
+    parser.add_argument("--sink-kbps", type=float, default=500.0, help="speed of the log reader, KiB/s")
+    args = parser.parse_args()
+
+    updates = [make_update(i) for i in range(args.bursts * args.burst_size)]
+    print(f"{args.bursts} bursts of {args.burst_size} updates, 2 records each, log reader at {args.sink_kbps:.0f} KiB/s\n")
+    print(f"{'setup':<24}{'logging ms':>11}{'p99 lag':>10}{'max lag':>10}{'handled':>9}{'drain s':>9}"
+          f"{'lines':>9}{'dropped':>9}")
+    measure("stream handler (old)", args, updates, stream_setup)
+    measure("queue + writer thread", args, updates, queue_setup(1.0))
+    measure("queue, 10% info sampled", args, updates, queue_setup(0.1))
+    print("\nlogging ms: time the event loop spent in logging calls; lag: delay of a 1 ms timer, ms;")
+    print("handled: seconds until the last burst was handled; drain: until the last line was read")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Service search latency on the real catalog and on a much larger one.
+
+The large catalog repeats every category of data/services.json `--scale`
+times with varied service names, so both the number of services and the
+vocabulary grow. Reports index build time, index memory and per-query
+latency for exact, prefix, transliterated and misspelled queries.
+
+Run from the repository root:
+
+    python -m benchmarks.search_bench --scale 1000
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from benchmarks.loadtest import percentile
+from catalog import DATA_DIR, Catalog, load_catalog
+from search import SearchIndex
+
+QUERIES = {
+    "exact": ["УЗИ почек", "Анализ мочи", "Buyrak UZI", "Консультация кардиолога"],
+    "prefix": ["узи", "анал", "kardio", "konsul"],
+    "latin for cyrillic": ["uzi pochek", "analiz mochi", "ekg", "kardiolog"],
+    "misspelled": ["анолиз мочи", "кардеолог", "uzi pochik", "konsultasiya urologa"],
+    "no match": ["стоматолог", "xyzzy"],
+}
+
+QUALIFIERS = {
+    "ru": ["детский", "повторный", "расширенный", "срочный", "на дому", "комплексный", "экспресс", "первичный"],
+    "uz": ["bolalar", "takroriy", "kengaytirilgan", "shoshilinch", "uyda", "kompleks", "ekspress", "birlamchi"],
+}
+
+
+def scaled_services(scale):
+    with open(os.path.join(DATA_DIR, 'services.json'), 'r', encoding='utf-8') as f:
+        services = json.load(f)
+    with open(os.path.join(DATA_DIR, 'translations.json'), 'r', encoding='utf-8') as f:
+        langs = list(json.load(f))
+    scaled = {lang: services[lang] for lang in langs if lang in services}
+    categories = [(key, category) for key, category in services.items() if key not in langs]
+    for copy in range(scale):
+        for key, category in categories:
+            scaled[f"{key} {copy}"] = {
+                lang: {
+                    "name": f"{category[lang]['name']} {copy}",
+                    "services": [
+                        {
+                            "name": f"{item['name']} {QUALIFIERS[lang][(copy + i) % len(QUALIFIERS[lang])]} {copy}",
+                            "price": item['price']
+                        }
+                        for i, item in enumerate(category[lang]['services'])
+                    ]
+                }
+                for lang in langs
+            }
+    return scaled
+
+
+def measure(catalog, repeat):
+    results = {}
+    for kind, queries in QUERIES.items():
+        timings = []
+        for query in queries:
+            catalog.search(query, 'ru')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                catalog.search(query, 'ru')
+                timings.append(time.perf_counter() - started)
+        timings.sort()
+        results[kind] = (percentile(timings, 0.5), percentile(timings, 0.99))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1000, help="copies of every category in the large catalog")
+    parser.add_argument("--repeat", type=int, default=200, help="runs of every query")
+    args = parser.parse_args()
+
+    real = load_catalog()
+    with open(os.path.join(DATA_DIR, 'translations.json'), 'r', encoding='utf-8') as f:
+        translations = json.load(f)
+    with open(os.path.join(DATA_DIR, 'contacts.json'), 'r', encoding='utf-8') as f:
+        contacts = json.load(f)
+    large = Catalog(translations, scaled_services(args.scale), contacts)
+
+    started = time.perf_counter()
+    index = SearchIndex.from_catalog(large)
+    build = time.perf_counter() - started
+    # Tracing slows the build down, so memory is measured on a second one
+    del index
+    tracemalloc.start()
+    index = SearchIndex.from_catalog(large)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"real catalog: {len(real.search_index)} services")
+    print(f"large catalog: {len(index)} services, index built in {build * 1000:.0f} ms, {memory / 2 ** 20:.1f} MiB\n")
+    print(f"{'query kind':<20}{'real p50':>10}{'p99':>10}{'large p50':>12}{'p99':>10}   (microseconds)")
+    small_results = measure(real, args.repeat)
+    large_results = measure(large, args.repeat)
+    for kind in QUERIES:
+        small_p50, small_p99 = small_results[kind]
+        large_p50, large_p99 = large_results[kind]
+        print(f"{kind:<20}{small_p50 * 1e6:>10.0f}{small_p99 * 1e6:>10.0f}{large_p50 * 1e6:>12.0f}{large_p99 * 1e6:>10.0f}")
+
+    print("\nlarge catalog, top results:")
+    for queries in QUERIES.values():
+        for query in queries[:2]:
+            names = [service.name for service in large.search(query, 'ru', 3)]
+            print(f"  {query!r}: {names}")
+
+
+if __name__ == "__main__":
+    main()
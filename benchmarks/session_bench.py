@@ -0,0 +1,74 @@
+"""Bot API request latency under concurrency for different session settings.
+
+Requests go to the fake Bot API from benchmarks.loadtest, so only the
+client side (connection pool, keep-alive) is measured.
+
+Run from the repository root:
+
+    python -m benchmarks.session_bench --requests 5000 --concurrency 200 --api-latency 20
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+
+from benchmarks.loadtest import FakeBotAPI, percentile
+from session import BotSession
+
+CONFIGS = {
+    "no keep-alive": dict(keepalive_timeout=None),
+    "pool of 10": dict(limit=10),
+    "pool of 100": dict(limit=100),
+    "pool of 300": dict(limit=300),
+}
+
+
+async def run_config(api, options, requests, concurrency):
+    session = BotSession(api=TelegramAPIServer.from_base(api.base_url), **options)
+    bot = Bot(token="123456:BENCH", session=session)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.send_message(chat_id=i, text="ping")
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        await bot.send_message(chat_id=0, text="warm up")
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+    return elapsed, latencies
+
+
+async def main_async(args):
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+    try:
+        print(f"{args.requests} sendMessage calls, concurrency {args.concurrency}, "
+              f"API latency {args.api_latency} ms\n")
+        print(f"{'session':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for name, options in CONFIGS.items():
+            elapsed, latencies = await run_config(api, options, args.requests, args.concurrency)
+            print(f"{name:<16}{len(latencies) / elapsed:>10.0f}"
+                  f"{percentile(latencies, 0.50) * 1000:>10.2f}{percentile(latencies, 0.99) * 1000:>10.2f}")
+    finally:
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--api-latency", type=float, default=20.0, help="delay of every fake Bot API call, ms")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
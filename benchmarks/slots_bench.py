@@ -0,0 +1,141 @@
+"""Many patients booking the same few time slots at once.
+
+Every attempt picks a random free-looking slot of the clinic schedule from
+data/contacts.json and tries to reserve it, all attempts of a process
+started together. With several processes they share one SQLite file, like
+cluster workers do. Afterwards the database is checked: every slot must be
+booked at most once and every successful reservation must be in it.
+
+Run from the repository root:
+
+    python -m benchmarks.slots_bench --attempts 5000 --processes 1 2 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.loadtest import percentile
+
+
+def candidate_slots(schedule, categories):
+    """All (category, day, slot) from tomorrow on, so the booking lead time never matters"""
+    from slots import slot_bits
+
+    tomorrow = date.today() + timedelta(days=1)
+    return [
+        (f"category{i}", day, slot)
+        for i in range(categories)
+        for day in schedule.days(tomorrow)[:schedule.days_ahead - 1]
+        for slot in slot_bits(schedule.working(day))
+    ]
+
+
+async def book(path, attempts, categories, seed, start_at):
+    from catalog import load_catalog
+    from slots import SlotIndex
+
+    schedule = load_catalog().schedule
+    index = SlotIndex(path)
+    await index.start()
+    candidates = candidate_slots(schedule, categories)
+    rng = random.Random(seed)
+    latencies = []
+
+    async def attempt(user_id):
+        # Patients choose from what looks free to this process
+        category, day, _ = rng.choice(candidates)
+        free = index.free_slots(schedule, category, day) or [rng.choice(candidates)[2]]
+        started = time.perf_counter()
+        booked = await index.reserve(schedule, category, day, rng.choice(free), 0, user_id)
+        latencies.append(time.perf_counter() - started)
+        return booked
+
+    while time.time() < start_at:
+        await asyncio.sleep(0.001)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(attempt(seed * attempts + i) for i in range(attempts)))
+    elapsed = time.perf_counter() - started
+
+    # Cost of listing free days and times for one patient
+    lookups = 1000
+    lookup_started = time.perf_counter()
+    for i in range(lookups):
+        category = f"category{i % categories}"
+        for day in index.free_days(schedule, category):
+            index.free_slots(schedule, category, day)
+    lookup = (time.perf_counter() - lookup_started) / lookups
+
+    await index.close()
+    return sum(results), elapsed, sorted(latencies), lookup
+
+
+def worker(path, attempts, categories, seed, start_at, queue):
+    queue.put(asyncio.run(book(path, attempts, categories, seed, start_at)))
+
+
+def run(processes, attempts, categories):
+    from catalog import load_catalog
+
+    state_dir = tempfile.mkdtemp(prefix="medbot-slots-")
+    path = os.path.join(state_dir, "slots.sqlite3")
+    capacity = len(candidate_slots(load_catalog().schedule, categories))
+    try:
+        # Create the database before the workers race for it
+        sqlite3.connect(path).close()
+        queue = multiprocessing.Queue()
+        start_at = time.time() + 3.0
+        workers = [
+            multiprocessing.Process(
+                target=worker, args=(path, attempts // processes, categories, seed, start_at, queue)
+            )
+            for seed in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        results = [queue.get() for _ in workers]
+        for process in workers:
+            process.join()
+
+        conn = sqlite3.connect(path)
+        rows, distinct = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT category || ':' || day || ':' || slot) FROM booked_slots"
+        ).fetchone()
+        conn.close()
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    booked = sum(result[0] for result in results)
+    elapsed = max(result[1] for result in results)
+    latencies = sorted(latency for result in results for latency in result[2])
+    lookup = max(result[3] for result in results)
+    assert rows == distinct == booked <= capacity, (rows, distinct, booked, capacity)
+    return capacity, booked, elapsed, latencies, lookup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--attempts", type=int, default=5000, help="booking attempts in total")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--categories", type=int, default=3, help="categories with their own slots")
+    args = parser.parse_args()
+
+    print(f"{args.attempts} simultaneous booking attempts, {args.categories} categories\n")
+    print(f"{'processes':>10}{'slots':>8}{'booked':>8}{'attempts/s':>12}{'p50 ms':>9}{'p99 ms':>9}{'lookup us':>11}")
+    for processes in args.processes:
+        capacity, booked, elapsed, latencies, lookup = run(processes, args.attempts, args.categories)
+        print(
+            f"{processes:>10}{capacity:>8}{booked:>8}{args.attempts / elapsed:>12.0f}"
+            f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.99) * 1000:>9.1f}{lookup * 1e6:>11.1f}"
+        )
+    print("\nno slot was booked twice")
+
+
+if __name__ == "__main__":
+    main()
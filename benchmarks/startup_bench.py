@@ -0,0 +1,106 @@
+"""Startup cost of the bot: import time and time to the first handled update.
+
+Import time comes from `python -X importtime -c "import main"`. For the time
+to first update, main.py is started as a separate process against the fake
+Bot API from benchmarks.loadtest with one /start update waiting in
+getUpdates; the clock stops when the reply (sendMessage) arrives.
+
+Run from the repository root:
+
+    python -m benchmarks.startup_bench --runs 5
+"""
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.loadtest import FakeBotAPI, UpdateFactory
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def bot_env(state_dir, api_url=None):
+    env = dict(os.environ)
+    for name in ("METRICS_PORT", "MEDIA_PREWARM", "WEBHOOK_URL"):
+        env.pop(name, None)
+    env.update(BOT_TOKEN="123456:STARTUP", STATE_DIR=state_dir, BOT_MODE="polling")
+    if api_url:
+        env["BOT_API_URL"] = api_url
+    return env
+
+
+def measure_imports(state_dir, top):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=bot_env(state_dir), capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, len(indent), int(self_us), int(cumulative_us)))
+    total = next(cumulative for name, _, _, cumulative in modules if name == "main")
+    # Modules imported while main.py itself is loading
+    direct = sorted((m for m in modules if m[1] == 3), key=lambda m: -m[3])[:top]
+    return total, direct
+
+
+async def time_to_first_update(state_dir, timeout=120.0):
+    api = FakeBotAPI()
+    await api.start()
+    api.updates.append(UpdateFactory(42).message("/start"))
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py",
+        env=bot_env(state_dir, api.base_url),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while "sendMessage" not in api.first_call:
+            if process.returncode is not None or time.perf_counter() - started > timeout:
+                raise RuntimeError("the bot did not answer the first update")
+            await asyncio.sleep(0.01)
+        return {method: api.first_call[method] - started for method in ("getMe", "getUpdates", "sendMessage")}
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="number of direct imports to list")
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix="medbot-startup-")
+    try:
+        total, direct = measure_imports(state_dir, args.top)
+        print(f"import main: {total / 1000:.0f} ms (python -X importtime)")
+        for name, _, _, cumulative in direct:
+            print(f"  {name:<40}{cumulative / 1000:>8.0f} ms")
+
+        runs = [asyncio.run(time_to_first_update(state_dir)) for _ in range(args.runs)]
+        print(f"\nmedian of {args.runs} runs, seconds since process start:")
+        for method, label in (("getMe", "getMe sent"), ("getUpdates", "polling started"),
+                              ("sendMessage", "first update answered")):
+            print(f"  {label:<24}{statistics.median(run[method] for run in runs):>8.3f}")
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Announcements to every user who ever started the bot.
+
+A broadcast is a job in SQLite: the message rendered for every language and
+a cursor, the id of the last user it got to. The sender reads users in
+chunks ordered by id from the language store, sends a chunk with bounded
+concurrency as bulk traffic (so replies to patients go first through the
+rate limiter) and saves the cursor and counters after every chunk. After a
+restart the job continues from its cursor; at most one chunk is sent again.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+from db import open_db, state_path
+from language_store import LanguageStore
+from ratelimit import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = (
+    'id', 'created_at', 'created_by', 'texts', 'status', 'cursor',
+    'sent', 'blocked', 'failed', 'elapsed', 'finished_at',
+)
+
+
+def render(translations: Mapping[str, Mapping[str, Any]], message: str) -> Dict[str, str]:
+    """Text per language: a translations.json key is translated, anything else is sent as is"""
+    texts = {}
+    for lang, strings in translations.items():
+        text = strings.get(message, message)
+        texts[lang] = "\n".join(text) if isinstance(text, (list, tuple)) else text
+    return texts
+
+
+def format_job(job: Dict[str, Any]) -> str:
+    """Human readable progress of a broadcast"""
+    done = job['sent'] + job['blocked'] + job['failed']
+    rate = done / job['elapsed'] if job['elapsed'] else 0.0
+    return (
+        f"📣 Рассылка #{job['id']}: {job['status']}\n"
+        f"✅ Отправлено: {job['sent']}\n"
+        f"🚫 Заблокировали бота: {job['blocked']}\n"
+        f"⚠️ Ошибки: {job['failed']}\n"
+        f"⏱ {job['elapsed']:.0f} с, {rate:.1f} сообщ./с"
+    )
+
+
+class Broadcaster:
+    """Runs broadcast jobs one at a time, resuming unfinished ones on start"""
+
+    def __init__(
+        self,
+        store: LanguageStore,
+        path: Optional[str] = None,
+        chunk_size: int = 200,
+        concurrency: int = 20,
+        poll_interval: float = 30.0
+    ):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._conn = open_db(path or state_path("broadcasts.sqlite3"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, created_by INTEGER, "
+            "texts TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'running', cursor INTEGER NOT NULL DEFAULT 0, "
+            "sent INTEGER NOT NULL DEFAULT 0, blocked INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+            "elapsed REAL NOT NULL DEFAULT 0, finished_at REAL)"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # Blocking database access, run in a worker thread
+
+    def _query_job(self, where: str, params: Tuple[Any, ...] = ()) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM broadcasts {where} ORDER BY id LIMIT 1", params
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job['texts'] = json.loads(job['texts'])
+        return job
+
+    def _insert(self, created_by: int, texts: Dict[str, str]) -> int:
+        with self._db_lock:
+            with self._conn:
+                return self._conn.execute(
+                    "INSERT INTO broadcasts (created_at, created_by, texts) VALUES (?, ?, ?)",
+                    (time.time(), created_by, json.dumps(texts, ensure_ascii=False))
+                ).lastrowid
+
+    def _checkpoint(self, job: Dict[str, Any]) -> None:
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE broadcasts SET cursor = ?, sent = ?, blocked = ?, failed = ?, elapsed = ?, "
+                    "status = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                    (job['cursor'], job['sent'], job['blocked'], job['failed'], job['elapsed'],
+                     job['status'], job['finished_at'], job['id'])
+                )
+
+    def _cancel(self) -> Optional[int]:
+        with self._db_lock:
+            with self._conn:
+                row = self._conn.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    "UPDATE broadcasts SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), row[0])
+                )
+                return row[0]
+
+    # Admin commands
+
+    async def create(self, created_by: int, texts: Dict[str, str]) -> int:
+        """Queue a broadcast; returns its id"""
+        job_id = await asyncio.to_thread(self._insert, created_by, texts)
+        self._wakeup.set()
+        return job_id
+
+    async def cancel(self) -> Optional[int]:
+        """Stop the running broadcast after the current chunk; returns its id"""
+        return await asyncio.to_thread(self._cancel)
+
+    async def latest(self) -> Optional[Dict[str, Any]]:
+        """The running broadcast, or the last one if none is running"""
+        job = await asyncio.to_thread(self._query_job, "WHERE status = 'running'")
+        if job is None:
+            job = await asyncio.to_thread(self._query_job, "WHERE id = (SELECT MAX(id) FROM broadcasts)")
+        return job
+
+    # Sending
+
+    async def _send(self, bot: Bot, user_id: int, text: str) -> str:
+        try:
+            await bot.send_message(chat_id=user_id, text=text)
+            return 'sent'
+        except TelegramForbiddenError:
+            return 'blocked'
+        except TelegramAPIError as e:
+            logger.warning(f"Broadcast to {user_id} failed: {e}")
+            return 'failed'
+
+    async def _send_chunk(self, bot: Bot, job: Dict[str, Any], users) -> None:
+        texts = job['texts']
+        default = next(iter(texts.values()))
+        queue = iter(users)
+
+        async def sender() -> None:
+            # A fixed number of senders bounds the messages in flight
+            for user_id, lang in queue:
+                job[await self._send(bot, user_id, texts.get(lang, default))] += 1
+
+        await asyncio.gather(*(sender() for _ in range(min(self.concurrency, len(users)))))
+
+    async def _run_job(self, bot: Bot, job: Dict[str, Any]) -> None:
+        logger.info(f"Broadcast #{job['id']} running from user {job['cursor']}")
+        while True:
+            users = await self.store.users(after=job['cursor'], limit=self.chunk_size)
+            if not users:
+                job['status'] = 'done'
+                job['finished_at'] = time.time()
+                await asyncio.to_thread(self._checkpoint, job)
+                break
+            started = time.monotonic()
+            await self._send_chunk(bot, job, users)
+            job['elapsed'] += time.monotonic() - started
+            job['cursor'] = users[-1][0]
+            await asyncio.to_thread(self._checkpoint, job)
+            done = job['sent'] + job['blocked'] + job['failed']
+            logger.info(
+                f"Broadcast #{job['id']}: {done} users, {job['sent']} sent, "
+                f"{done / job['elapsed']:.1f} msg/s"
+            )
+            # Cancelled by an admin, possibly in another process
+            current = await asyncio.to_thread(self._query_job, "WHERE id = ?", (job['id'],))
+            if current is None or current['status'] != 'running':
+                job['status'] = current['status'] if current else 'cancelled'
+                break
+        logger.info(f"Broadcast #{job['id']} {job['status']}")
+        if job['created_by']:
+            try:
+                await bot.send_message(chat_id=job['created_by'], text=format_job(job))
+            except TelegramAPIError as e:
+                logger.error(f"Failed to report broadcast #{job['id']}: {e}")
+
+    async def _loop(self, bot: Bot) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self._query_job, "WHERE status = 'running'")
+                if job is not None:
+                    with bulk_sends():
+                        await self._run_job(bot, job)
+                    continue
+            except Exception as e:
+                logger.error(f"Broadcast error: {e}")
+            # Jobs created by other bot processes are found by polling
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self, bot: Bot) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(bot))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._db_lock:
+            self._conn.close()
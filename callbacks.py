@@ -0,0 +1,125 @@
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from aiogram import types
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+
+from logs import set_handler
+from metrics import observe_handler
+
+logger = logging.getLogger(__name__)
+
+
+class LanguageCallback(CallbackData, prefix="lang"):
+    lang: str
+
+
+class ContactCallback(CallbackData, prefix="contact"):
+    kind: str
+
+
+class ServiceCallback(CallbackData, prefix="service"):
+    category: int
+    service: int
+
+
+# Short prefixes keep page buttons well under Telegram's 64 byte limit
+class CategoryPageCallback(CallbackData, prefix="cp"):
+    page: int
+
+
+class ServicePageCallback(CallbackData, prefix="sp"):
+    category: int
+    page: int
+
+
+# Days are date ordinals; the service being booked is kept in the FSM state
+class DayCallback(CallbackData, prefix="day"):
+    day: int
+
+
+class SlotCallback(CallbackData, prefix="slot"):
+    day: int
+    slot: int
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRouter:
+    """Dispatches callback queries with a single dict lookup.
+
+    Plain buttons are routed by their exact callback data, buttons built from a
+    CallbackData factory by its prefix. The payload is unpacked once and passed
+    to the handler as `callback_data`.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Tuple[Handler, bool]] = {}
+        self._prefixes: Dict[str, Tuple[Type[CallbackData], Handler, bool]] = {}
+
+    @staticmethod
+    def _wants_state(handler: Handler) -> bool:
+        return 'state' in inspect.signature(handler).parameters
+
+    def exact(self, data: str):
+        """Register a handler for callback data equal to `data`"""
+        def decorator(handler: Handler) -> Handler:
+            if data in self._exact:
+                raise ValueError(f"Callback {data!r} is already routed")
+            self._exact[data] = (handler, self._wants_state(handler))
+            return handler
+        return decorator
+
+    def route(self, factory: Type[CallbackData]):
+        """Register a handler for callback data packed by `factory`"""
+        def decorator(handler: Handler) -> Handler:
+            prefix = factory.__prefix__
+            if prefix in self._prefixes:
+                raise ValueError(f"Callback prefix {prefix!r} is already routed")
+            self._prefixes[prefix] = (factory, handler, self._wants_state(handler))
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Optional[Tuple[Handler, Optional[CallbackData], bool]]:
+        """Find the handler for callback data and unpack its payload"""
+        route = self._exact.get(data)
+        if route is not None:
+            handler, wants_state = route
+            return handler, None, wants_state
+        prefix = data.split(':', 1)[0]
+        route = self._prefixes.get(prefix)
+        if route is None:
+            return None
+        factory, handler, wants_state = route
+        return handler, factory.unpack(data), wants_state
+
+    async def dispatch(self, callback: types.CallbackQuery, state: FSMContext) -> Any:
+        try:
+            resolved = self.resolve(callback.data or '')
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Malformed callback data {callback.data!r}: {e}")
+            resolved = None
+        if resolved is None:
+            # Buttons from outdated messages: just stop the loading spinner
+            await callback.answer()
+            return None
+        handler, callback_data, wants_state = resolved
+        kwargs: Dict[str, Any] = {}
+        if callback_data is not None:
+            kwargs['callback_data'] = callback_data
+        if wants_state:
+            kwargs['state'] = state
+        set_handler(handler.__name__)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(callback, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            observe_handler(handler.__name__, started, failed)
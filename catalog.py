@@ -0,0 +1,308 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from search import SearchIndex
+from slots import Schedule
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+DATA_FILES = ('translations.json', 'services.json', 'contacts.json')
+
+
+class CatalogError(ValueError):
+    """Raised when a data file doesn't match the expected schema"""
+
+
+@dataclass(frozen=True)
+class Service:
+    category_id: int
+    service_id: int
+    lang: str
+    name: str
+    price: str
+
+
+@dataclass(frozen=True)
+class Category:
+    category_id: int
+    key: str
+    names: Mapping[str, str]
+    services: Mapping[str, Tuple[Service, ...]]
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts and lists into read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _require(condition: bool, message: str) -> None:
+    if not condition:
+        raise CatalogError(message)
+
+
+def _validate_translations(translations: Any) -> None:
+    _require(isinstance(translations, dict) and translations, "translations.json must be a non-empty object")
+    keys = None
+    for lang, texts in translations.items():
+        _require(isinstance(texts, dict), f"translations.json: '{lang}' must be an object")
+        for key, text in texts.items():
+            _require(
+                isinstance(text, str) or (isinstance(text, list) and all(isinstance(t, str) for t in text)),
+                f"translations.json: '{lang}.{key}' must be a string or a list of strings"
+            )
+        if keys is None:
+            keys = set(texts)
+        else:
+            missing = keys.symmetric_difference(texts)
+            _require(not missing, f"translations.json: '{lang}' has mismatched keys: {sorted(missing)}")
+
+
+def _validate_services(services: Any, langs) -> None:
+    _require(isinstance(services, dict), "services.json must be an object")
+    for key, category in services.items():
+        if key in langs:
+            # Per-language overview of the categories with starting prices
+            items = category.get('services') if isinstance(category, dict) else None
+            _require(isinstance(items, list), f"services.json: '{key}.services' must be a list")
+            for i, item in enumerate(items):
+                _require(
+                    isinstance(item, dict) and all(isinstance(item.get(k), str) for k in ('id', 'name', 'price')),
+                    f"services.json: '{key}.services[{i}]' needs string 'id', 'name' and 'price'"
+                )
+            continue
+        _require(isinstance(category, dict), f"services.json: category '{key}' must be an object")
+        counts = set()
+        for lang in langs:
+            _require(lang in category, f"services.json: category '{key}' has no '{lang}' section")
+            section = category[lang]
+            _require(isinstance(section.get('name'), str), f"services.json: '{key}.{lang}.name' must be a string")
+            items = section.get('services')
+            _require(isinstance(items, list), f"services.json: '{key}.{lang}.services' must be a list")
+            for i, item in enumerate(items):
+                _require(
+                    isinstance(item, dict) and isinstance(item.get('name'), str) and isinstance(item.get('price'), str),
+                    f"services.json: '{key}.{lang}.services[{i}]' needs string 'name' and 'price'"
+                )
+            counts.add(len(items))
+        _require(len(counts) <= 1, f"services.json: category '{key}' has a different number of services per language")
+
+
+def _validate_contacts(contacts: Any, langs) -> None:
+    _require(isinstance(contacts, dict), "contacts.json must be an object")
+    for lang in langs:
+        _require(lang in contacts, f"contacts.json: no '{lang}' section")
+        section = contacts[lang]
+        _require(isinstance(section.get('phone'), str), f"contacts.json: '{lang}.phone' must be a string")
+        location = section.get('location')
+        _require(
+            isinstance(location, dict) and all(isinstance(location.get(k), (int, float)) for k in ('latitude', 'longitude')),
+            f"contacts.json: '{lang}.location' needs numeric latitude and longitude"
+        )
+
+
+class Catalog:
+    """Read-only snapshot of translations, services and contacts with lookup indexes"""
+
+    def __init__(self, translations: Dict[str, Any], services: Dict[str, Any], contacts: Dict[str, Any]):
+        _validate_translations(translations)
+        self.languages: Tuple[str, ...] = tuple(translations)
+        _validate_services(services, self.languages)
+        _validate_contacts(contacts, self.languages)
+
+        self.translations: Mapping[str, Mapping[str, str]] = _freeze(translations)
+        self.contacts: Mapping[str, Any] = _freeze(contacts)
+        # Working hours for booking time slots; without them admins agree on a time by phone
+        try:
+            self.schedule: Optional[Schedule] = Schedule.from_dict(contacts['schedule']) if 'schedule' in contacts else None
+        except (TypeError, ValueError) as e:
+            raise CatalogError(f"contacts.json: invalid schedule: {e}") from e
+        self.overview: Mapping[str, Tuple[Mapping[str, str], ...]] = _freeze({
+            lang: services[lang]['services'] if lang in services else [] for lang in self.languages
+        })
+
+        categories = []
+        services_index: Dict[Tuple[int, str, int], Service] = {}
+        price_lists: Dict[str, list] = {lang: [] for lang in self.languages}
+        category_items = [(key, category) for key, category in services.items() if key not in self.languages]
+        for category_id, (key, category) in enumerate(category_items):
+            by_lang = {}
+            for lang in self.languages:
+                items = tuple(
+                    Service(category_id, service_id, lang, item['name'], item['price'])
+                    for service_id, item in enumerate(category[lang]['services'])
+                )
+                by_lang[lang] = items
+                price_lists[lang].extend(items)
+                for item in items:
+                    services_index[(category_id, lang, item.service_id)] = item
+            categories.append(Category(
+                category_id=category_id,
+                key=key,
+                names=MappingProxyType({lang: category[lang]['name'] for lang in self.languages}),
+                services=MappingProxyType(by_lang)
+            ))
+
+        self.categories: Tuple[Category, ...] = tuple(categories)
+        self._categories_by_key = {category.key: category for category in categories}
+        self._services = services_index
+        self._price_lists = {lang: tuple(items) for lang, items in price_lists.items()}
+        # Built with the snapshot, so reloads never rebuild it on the event loop
+        self.search_index = SearchIndex.from_catalog(self)
+
+    def category(self, category_id: int) -> Optional[Category]:
+        if 0 <= category_id < len(self.categories):
+            return self.categories[category_id]
+        return None
+
+    def category_by_key(self, key: str) -> Optional[Category]:
+        """Category by its services.json key, which stays the same across reloads"""
+        return self._categories_by_key.get(key)
+
+    def service(self, category_id: int, lang: str, service_id: int) -> Optional[Service]:
+        return self._services.get((category_id, lang, service_id))
+
+    def price_list(self, lang: str) -> Tuple[Service, ...]:
+        """All services of every category, flattened, in catalog order"""
+        return self._price_lists.get(lang, ())
+
+    def search(self, query: str, lang: str, limit: int = 5) -> List[Service]:
+        """Services whose name in any language looks like `query`, best match first"""
+        return [
+            self._services[(hit.category_id, lang, hit.service_id)]
+            for hit in self.search_index.search(query, limit)
+        ]
+
+
+def _data_signature(data_dir: str):
+    signature = []
+    for filename in DATA_FILES:
+        stat = os.stat(os.path.join(data_dir, filename))
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_catalog(data_dir: str = DATA_DIR) -> Catalog:
+    """Parse and validate every data file once"""
+    raw = {}
+    for filename in DATA_FILES:
+        path = os.path.join(data_dir, filename)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                raw[filename] = json.load(f)
+        except ValueError as e:
+            raise CatalogError(f"{path} is not valid JSON: {e}") from e
+    return Catalog(raw['translations.json'], raw['services.json'], raw['contacts.json'])
+
+
+def diff_catalogs(old: Catalog, new: Catalog) -> List[str]:
+    """Describe what changed between two catalogs, one line per change"""
+    changes = []
+    for lang in sorted(set(old.languages) | set(new.languages)):
+        old_texts = old.translations.get(lang, {})
+        new_texts = new.translations.get(lang, {})
+        for key in sorted(set(old_texts) | set(new_texts)):
+            if old_texts.get(key) != new_texts.get(key):
+                changes.append(f"translation {lang}.{key} changed")
+        old_prices = {(s.category_id, s.service_id): s for s in old.price_list(lang)}
+        new_prices = {(s.category_id, s.service_id): s for s in new.price_list(lang)}
+        for key in sorted(set(old_prices) | set(new_prices)):
+            before, after = old_prices.get(key), new_prices.get(key)
+            if before is None:
+                changes.append(f"service added [{lang}]: {after.name} ({after.price})")
+            elif after is None:
+                changes.append(f"service removed [{lang}]: {before.name}")
+            elif before != after:
+                changes.append(f"service changed [{lang}]: {before.name} ({before.price}) -> {after.name} ({after.price})")
+        if old.overview.get(lang) != new.overview.get(lang):
+            changes.append(f"services overview [{lang}] changed")
+        if old.contacts.get(lang) != new.contacts.get(lang):
+            changes.append(f"contacts [{lang}] changed")
+    if old.schedule != new.schedule:
+        changes.append("schedule changed")
+    return changes
+
+
+# Current catalog snapshot, replaced as a whole by CatalogWatcher
+_catalog: Optional[Catalog] = None
+
+
+def get_catalog() -> Catalog:
+    """Return the current catalog snapshot. Handlers should call it once per update."""
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog(DATA_DIR)
+    return _catalog
+
+
+class CatalogWatcher:
+    """Polls the data files and swaps in a new catalog when they change.
+
+    Files are parsed in a worker thread. A reload is only applied if the
+    files didn't change while being parsed and the result validates, so a
+    half-written file never replaces a good catalog.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, interval: float = 2.0):
+        self.data_dir = data_dir
+        self.interval = interval
+        self._signature = None
+        self._rejected = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def check(self) -> bool:
+        """Reload the catalog if the data files changed; return True if it was swapped"""
+        global _catalog
+        signature = await asyncio.to_thread(_data_signature, self.data_dir)
+        if signature == self._signature or signature == self._rejected:
+            return False
+        try:
+            catalog = await asyncio.to_thread(load_catalog, self.data_dir)
+        except CatalogError as e:
+            # Don't parse (and log) the same broken files on every poll
+            self._rejected = signature
+            logger.error(f"Ignoring invalid data files: {e}")
+            return False
+        if await asyncio.to_thread(_data_signature, self.data_dir) != signature:
+            # Still being written; try again on the next poll
+            return False
+        self._signature = signature
+        old = _catalog
+        _catalog = catalog
+        if old is not None:
+            changes = diff_catalogs(old, catalog)
+            logger.info(f"Catalog reloaded, {len(changes)} change(s)")
+            for change in changes:
+                logger.info(f"  {change}")
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except OSError as e:
+                logger.error(f"Failed to check data files: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._signature = await asyncio.to_thread(_data_signature, self.data_dir)
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
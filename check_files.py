@@ -1,5 +1,8 @@
 import os
 import json
+import shutil
+
+from media import LANGUAGES, MAX_UPLOAD_SIZE, VIDEO_NAMES, MediaIndex, is_faststart, resolve_video
 
 def check_files():
     print("Checking required files...")
@@ -31,23 +34,31 @@ def check_files():
     else:
         print("✅ data/videos directory exists")
     
-    # Check video files
-    video_files = [
-        "location_ru.mp4",
-        "location_uz.mp4",
-        "clinic_ru.mp4",
-        "clinic_uz.mp4"
-    ]
-    
+    # Check video files: one per language, {name}.mp4 is used as a fallback
     missing_videos = []
-    for file in video_files:
-        path = f"data/videos/{file}"
-        if os.path.exists(path):
-            size = os.path.getsize(path) / 1024  # Size in KB
-            print(f"✅ {path} exists ({size:.1f} KB)")
-        else:
-            print(f"❌ {path} not found")
-            missing_videos.append(file)
+    index = MediaIndex()
+    for name in VIDEO_NAMES:
+        for lang in LANGUAGES:
+            file = f"{name}_{lang}.mp4"
+            path = resolve_video(name, lang)
+            if path is None:
+                print(f"❌ data/videos/{file} not found and there is no fallback")
+                missing_videos.append(file)
+                continue
+            size = os.path.getsize(path)
+            if os.path.basename(path) == file:
+                print(f"✅ {path} exists ({size / 1024:.1f} KB)")
+            else:
+                print(f"⚠️ data/videos/{file} not found, {path} will be sent instead")
+                missing_videos.append(file)
+            if size > MAX_UPLOAD_SIZE:
+                print(f"  ❌ {path} is over 50MB, run: python media.py transcode")
+            if not is_faststart(path):
+                print(f"  ⚠️ {path} cannot stream before it is fully downloaded, run: python media.py transcode")
+            if index.get(path) is None:
+                print(f"  ⚠️ {path} has no duration/thumbnail metadata, run: python media.py scan")
+    if shutil.which("ffprobe") is None:
+        print("⚠️ ffprobe not found; install ffmpeg to index and transcode videos")
     
     # Check .env file
     if os.path.exists(".env"):
@@ -0,0 +1,316 @@
+"""Run the bot as several worker processes behind one update receiver.
+
+One front process receives updates, by long polling or as a webhook, and
+forwards each of them to a worker chosen by user id, so all updates of a
+user go to the same worker and arrive there in order. Workers are ordinary
+`main.py --mode webhook` processes listening on localhost. They share user
+languages, FSM state, the appointment ledger and the admin outbox through
+the SQLite files in STATE_DIR (or through Redis when REDIS_URL is set), and
+only worker 0 sends admin notifications and broadcasts.
+
+    python cluster.py --workers 4
+    python cluster.py --workers 4 --mode webhook --port 8080 --webhook-url https://bot.example.com
+"""
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+from dotenv import load_dotenv
+
+from logs import setup_logging_from_env
+
+logger = logging.getLogger(__name__)
+
+WORKER_PATH = "/updates"
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Id of the user (or chat) an update belongs to"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+
+class UpdateRouter:
+    """Forwards updates to workers, partitioned by user id.
+
+    Each worker gets `lanes` queues; a user always maps to the same lane and
+    a lane sends one update at a time, which keeps every user's updates in
+    order while different users are forwarded in parallel. A full lane makes
+    submit() wait, so a slow worker slows down the receiver instead of
+    filling memory. Failed forwards are retried until the worker is back.
+    """
+
+    def __init__(self, worker_urls: List[str], secret: str, lanes: int = 8, queue_size: int = 1000):
+        self.worker_urls = worker_urls
+        self.secret = secret
+        self.lanes = lanes
+        self._queues = [asyncio.Queue(queue_size) for _ in range(len(worker_urls) * lanes)]
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[ClientSession] = None
+        self.forwarded = [0] * len(worker_urls)
+
+    def partition(self, user_id: int) -> int:
+        """Lane index; lanes of worker i are i * lanes ... (i + 1) * lanes - 1"""
+        workers = len(self.worker_urls)
+        return (user_id % workers) * self.lanes + (user_id // workers) % self.lanes
+
+    async def submit(self, update: Dict[str, Any]) -> None:
+        user_id = update_user_id(update)
+        if user_id is None:
+            user_id = update.get("update_id", 0)
+        await self._queues[self.partition(user_id)].put(update)
+
+    async def _forward(self, worker: int, update: Dict[str, Any]) -> None:
+        delay = 0.1
+        while True:
+            try:
+                async with self._session.post(
+                    self.worker_urls[worker],
+                    json=update,
+                    headers={"X-Telegram-Bot-Api-Secret-Token": self.secret}
+                ) as response:
+                    if response.status < 500:
+                        if response.status != 200:
+                            logger.error(f"Worker {worker} rejected update {update.get('update_id')}: HTTP {response.status}")
+                        return
+                    reason = f"HTTP {response.status}"
+            except (ClientError, asyncio.TimeoutError) as e:
+                reason = f"{type(e).__name__}: {e}"
+            logger.warning(f"Worker {worker} unavailable ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    async def _run_lane(self, lane: int) -> None:
+        queue = self._queues[lane]
+        worker = lane // self.lanes
+        while True:
+            update = await queue.get()
+            try:
+                await self._forward(worker, update)
+                self.forwarded[worker] += 1
+            finally:
+                queue.task_done()
+
+    async def start(self) -> None:
+        self._session = ClientSession(connector=TCPConnector(limit=0), timeout=ClientTimeout(total=30))
+        self._tasks = [asyncio.create_task(self._run_lane(lane)) for lane in range(len(self._queues))]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+
+
+class WorkerPool:
+    """Starts `main.py --mode webhook` workers on consecutive ports and restarts them if they exit"""
+
+    def __init__(self, count: int, base_port: int = 8100, secret: Optional[str] = None, env: Optional[Dict[str, str]] = None):
+        self.count = count
+        self.base_port = base_port
+        self.secret = secret or secrets.token_urlsafe(24)
+        self.env = dict(os.environ if env is None else env)
+        self._processes: List[Optional[asyncio.subprocess.Process]] = [None] * count
+        self._supervisors: List[asyncio.Task] = []
+
+    @property
+    def urls(self) -> List[str]:
+        return [f"http://127.0.0.1:{self.base_port + i}{WORKER_PATH}" for i in range(self.count)]
+
+    def _worker_env(self, worker: int) -> Dict[str, str]:
+        env = dict(self.env)
+        # Workers never register a webhook with Telegram themselves
+        env.pop("WEBHOOK_URL", None)
+        env.update(
+            WEBHOOK_SECRET=self.secret,
+            CLUSTER_WORKER=str(worker),
+            OUTBOX_SENDER="1" if worker == 0 else "0"
+        )
+        # Telegram's global limit is per bot, so workers split it
+        env["RATE_LIMIT_GLOBAL"] = str(float(env.get("RATE_LIMIT_GLOBAL", "30")) / self.count)
+        if env.get("METRICS_PORT"):
+            env["METRICS_PORT"] = str(int(env["METRICS_PORT"]) + worker)
+        return env
+
+    async def _spawn(self, worker: int) -> asyncio.subprocess.Process:
+        root = os.path.dirname(os.path.abspath(__file__))
+        return await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(root, "main.py"),
+            "--mode", "webhook",
+            "--host", "127.0.0.1",
+            "--port", str(self.base_port + worker),
+            "--path", WORKER_PATH,
+            cwd=root,
+            env=self._worker_env(worker)
+        )
+
+    async def _supervise(self, worker: int) -> None:
+        while True:
+            process = self._processes[worker] = await self._spawn(worker)
+            code = await process.wait()
+            logger.error(f"Worker {worker} exited with code {code}, restarting")
+            await asyncio.sleep(1)
+
+    async def start(self) -> None:
+        self._supervisors = [asyncio.create_task(self._supervise(i)) for i in range(self.count)]
+
+    async def wait_ready(self, timeout: float = 120.0) -> None:
+        """Wait until every worker accepts HTTP connections"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with ClientSession() as session:
+            for url in self.urls:
+                while True:
+                    try:
+                        async with session.get(url):
+                            break
+                    except ClientError:
+                        if loop.time() > deadline:
+                            raise TimeoutError(f"Worker at {url} did not start")
+                        await asyncio.sleep(0.2)
+
+    async def close(self) -> None:
+        for task in self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        self._supervisors = []
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                process.send_signal(signal.SIGINT)
+        for process in self._processes:
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+
+async def poll_updates(bot, router: UpdateRouter, timeout: int = 30) -> None:
+    """Long-poll Telegram and hand every update to the router"""
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=timeout, allowed_updates=ALLOWED_UPDATES, request_timeout=timeout + 10
+            )
+        except Exception as e:
+            logger.error(f"Failed to fetch updates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await router.submit(update.model_dump(mode="json", exclude_unset=True, by_alias=True))
+            offset = update.update_id + 1
+
+
+async def serve_webhook(
+    router: UpdateRouter,
+    host: str,
+    port: int,
+    path: str,
+    secret_token: Optional[str],
+    bot=None,
+    webhook_url: Optional[str] = None
+) -> None:
+    """Accept updates from Telegram and hand them to the router until cancelled"""
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(body="Unauthorized", status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+        await router.submit(update)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Cluster webhook listening on http://{host}:{port}{path}")
+    if bot is not None and webhook_url:
+        await bot.set_webhook(
+            url=webhook_url.rstrip('/') + path,
+            secret_token=secret_token,
+            allowed_updates=ALLOWED_UPDATES
+        )
+        logger.info(f"Webhook set to {webhook_url.rstrip('/') + path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_cluster(args) -> None:
+    from aiogram import Bot
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from session import BotSession
+
+    pool = WorkerPool(args.workers, base_port=args.worker_port)
+    router = UpdateRouter(pool.urls, pool.secret, lanes=args.lanes)
+    session = BotSession()
+    if os.getenv("BOT_API_URL"):
+        session.api = TelegramAPIServer.from_base(os.getenv("BOT_API_URL"))
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    await pool.start()
+    await router.start()
+    try:
+        await pool.wait_ready()
+        logger.info(f"{args.workers} workers ready")
+        if args.mode == "webhook":
+            await serve_webhook(
+                router, args.host, args.port, args.path, os.getenv("WEBHOOK_SECRET"), bot, args.webhook_url
+            )
+        else:
+            await poll_updates(bot, router)
+    finally:
+        await router.close()
+        await pool.close()
+        await bot.session.close()
+
+
+def main():
+    load_dotenv()
+    # Same format as the workers, which share this process's stdout
+    setup_logging_from_env()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--worker-port", type=int, default=8100, help="port of worker 0; worker i listens on port + i")
+    parser.add_argument("--lanes", type=int, default=8, help="parallel forwarding lanes per worker")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=os.getenv("BOT_MODE", "polling"))
+    parser.add_argument("--host", default=os.getenv("WEBHOOK_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("WEBHOOK_PORT", "8080")))
+    parser.add_argument("--path", default=os.getenv("WEBHOOK_PATH", "/webhook"))
+    parser.add_argument("--webhook-url", default=os.getenv("WEBHOOK_URL"))
+    args = parser.parse_args()
+    if not os.getenv("BOT_TOKEN"):
+        parser.error("BOT_TOKEN is not set")
+    try:
+        asyncio.run(run_cluster(args))
+    except KeyboardInterrupt:
+        logger.info("Cluster stopped by user")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import os
+import sqlite3
+
+# Directory for local databases (language store, FSM state, ...)
+STATE_DIR = os.getenv("STATE_DIR", "data/state")
+
+
+def state_path(filename: str) -> str:
+    """Return the path of a file inside STATE_DIR, creating the directory if needed"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, filename)
+
+
+def open_db(path: str) -> sqlite3.Connection:
+    """Open a SQLite database in WAL mode, shared by several processes"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+from db import open_db, state_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    updated_at: float = 0.0
+    last_access: float = 0.0
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in memory and persisted to SQLite.
+
+    Changes are buffered and written in one transaction by flush(), which
+    FSMFlushMiddleware calls once per update. Sessions untouched for `ttl`
+    seconds are treated as abandoned and removed.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 24 * 60 * 60,
+        idle_eviction: float = 10 * 60,
+        purge_interval: float = 60.0,
+        key_builder: Optional[KeyBuilder] = None
+    ):
+        self.ttl = ttl
+        self.idle_eviction = idle_eviction
+        self.purge_interval = purge_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._conn = open_db(path or state_path("fsm.sqlite3"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._records: Dict[str, _Record] = {}
+        self._dirty = set()
+        self._purger: Optional[asyncio.Task] = None
+
+    # Blocking database access, run in a worker thread
+
+    def _load_row(self, key: str) -> Optional[Tuple[Optional[str], str, float]]:
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _write_rows(self, upserts: List[Tuple[str, Optional[str], str, float]], deletes: List[str]) -> None:
+        with self._db_lock:
+            with self._conn:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                        "data = excluded.data, updated_at = excluded.updated_at",
+                        upserts
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM fsm WHERE key = ?", [(k,) for k in deletes])
+
+    def _delete_expired(self, cutoff: float) -> int:
+        with self._db_lock:
+            with self._conn:
+                return self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (cutoff,)).rowcount
+
+    # In-memory records
+
+    async def _record(self, key: StorageKey) -> Tuple[str, _Record]:
+        str_key = self.key_builder.build(key)
+        now = time.time()
+        record = self._records.get(str_key)
+        if record is None:
+            row = await asyncio.to_thread(self._load_row, str_key)
+            # Another coroutine may have created the record while we were reading
+            record = self._records.get(str_key)
+            if record is None:
+                record = _Record()
+                if row is not None:
+                    record.state, data, record.updated_at = row
+                    record.data = json.loads(data)
+                self._records[str_key] = record
+        if record.updated_at and now - record.updated_at > self.ttl:
+            record.state, record.data, record.updated_at = None, {}, 0.0
+            self._dirty.add(str_key)
+        record.last_access = now
+        return str_key, record
+
+    def _touch(self, str_key: str, record: _Record) -> None:
+        record.updated_at = time.time()
+        self._dirty.add(str_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        str_key, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(str_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        str_key, record = await self._record(key)
+        record.data = data.copy()
+        self._touch(str_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def flush(self) -> None:
+        """Write all buffered changes in a single transaction"""
+        if not self._dirty:
+            return
+        upserts = []
+        deletes = []
+        for str_key in self._dirty:
+            record = self._records.get(str_key)
+            if record is None or (record.state is None and not record.data):
+                deletes.append(str_key)
+            else:
+                upserts.append((str_key, record.state, json.dumps(record.data, ensure_ascii=False), record.updated_at))
+        self._dirty = set()
+        try:
+            await asyncio.to_thread(self._write_rows, upserts, deletes)
+        except Exception as e:
+            logger.error(f"Failed to persist FSM state for {len(upserts) + len(deletes)} keys: {e}")
+            self._dirty.update(k for k, *_ in upserts)
+            self._dirty.update(deletes)
+
+    async def purge(self) -> None:
+        """Drop expired sessions and evict idle ones from memory"""
+        now = time.time()
+        for str_key, record in list(self._records.items()):
+            if str_key in self._dirty:
+                continue
+            if now - record.last_access > self.idle_eviction or now - record.updated_at > self.ttl:
+                del self._records[str_key]
+        removed = await asyncio.to_thread(self._delete_expired, now - self.ttl)
+        if removed:
+            logger.info(f"Removed {removed} abandoned FSM sessions")
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            await self.flush()
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.error(f"Failed to purge FSM sessions: {e}")
+
+    async def start(self) -> None:
+        if self._purger is None:
+            self._purger = asyncio.create_task(self._purge_loop())
+
+    async def close(self) -> None:
+        if self._purger is not None:
+            self._purger.cancel()
+            try:
+                await self._purger
+            except asyncio.CancelledError:
+                pass
+            self._purger = None
+        await self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Persists FSM changes once, after the whole update has been handled"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush()
@@ -0,0 +1,277 @@
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from pydantic import ConfigDict
+
+from callbacks import (
+    CategoryPageCallback,
+    ContactCallback,
+    DayCallback,
+    LanguageCallback,
+    ServiceCallback,
+    ServicePageCallback,
+    SlotCallback
+)
+from catalog import Catalog, Service, get_catalog
+from slots import Schedule
+
+
+class FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """Inline keyboard shared between updates; it must never be modified"""
+    model_config = ConfigDict(frozen=True)
+
+
+def freeze(markup: InlineKeyboardMarkup) -> FrozenInlineKeyboardMarkup:
+    rows = [
+        [FrozenInlineKeyboardButton.model_validate(button.model_dump(exclude_none=True)) for button in row]
+        for row in markup.inline_keyboard
+    ]
+    return FrozenInlineKeyboardMarkup(inline_keyboard=rows)
+
+
+Builder = Callable[..., InlineKeyboardMarkup]
+
+
+class KeyboardRegistry:
+    """Builds each (screen, lang) keyboard once and serves the frozen markup afterwards.
+
+    Screens with pages take extra arguments (category, page, ...), which are
+    part of the cache key. Keyboards are tied to the catalog snapshot they
+    were built from; when the catalog is reloaded every keyboard is rebuilt
+    on first use.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Builder] = {}
+        self._cache: Dict[Tuple, FrozenInlineKeyboardMarkup] = {}
+        self._catalog: Optional[Catalog] = None
+
+    def register(self, screen: str):
+        def decorator(builder: Builder) -> Builder:
+            self._builders[screen] = builder
+            return builder
+        return decorator
+
+    def get(self, screen: str, lang: str, catalog: Optional[Catalog] = None, *args) -> FrozenInlineKeyboardMarkup:
+        if catalog is None:
+            catalog = get_catalog()
+        if catalog is not self._catalog:
+            self._cache = {}
+            self._catalog = catalog
+        key = (screen, lang) + args
+        markup = self._cache.get(key)
+        if markup is None:
+            markup = freeze(self._builders[screen](lang, catalog, *args))
+            self._cache[key] = markup
+        return markup
+
+    def warm(self, screen: str, langs, *args) -> None:
+        """Build a screen's keyboards ahead of the first update"""
+        for lang in langs:
+            self.get(screen, lang, None, *args)
+
+
+keyboards = KeyboardRegistry()
+
+
+# Language selection keyboard
+@keyboards.register('language')
+def build_language_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Русский 🇷🇺", callback_data=LanguageCallback(lang="ru"))
+    keyboard.button(text="O'zbek 🇺🇿", callback_data=LanguageCallback(lang="uz"))
+    return keyboard.as_markup()
+
+
+# Main menu keyboard
+@keyboards.register('main_menu')
+def build_main_menu_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    texts = catalog.translations[lang]
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text=texts['contacts'], callback_data="show_contacts")
+    keyboard.button(text=texts['appointment'], callback_data="start_appointment")
+    keyboard.button(text=texts['about_clinic'], callback_data="about_clinic")
+    return keyboard.as_markup()
+
+
+# Contacts menu keyboard
+@keyboards.register('contacts')
+def build_contacts_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    texts = catalog.translations[lang]
+    keyboard = InlineKeyboardBuilder()
+    # Add buttons in a column
+    keyboard.button(text=texts['location'], callback_data=ContactCallback(kind="location"))
+    keyboard.button(text=texts['video'], callback_data=ContactCallback(kind="video"))
+    keyboard.button(text=texts['call'], callback_data=ContactCallback(kind="call"))
+    keyboard.button(text=texts['back'], callback_data="back_to_main")
+    return keyboard.as_markup()
+
+
+# Call button with the clinic phone number
+@keyboards.register('call')
+def build_call_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    phone = catalog.contacts[lang]['phone']
+    # Format phone number for URL (remove spaces)
+    formatted_phone = phone.replace(" ", "")
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text=catalog.translations[lang]['call'], url=f"tg://resolve?phone={formatted_phone.lstrip('+')}")
+    return keyboard.as_markup()
+
+
+# Single back button (about clinic screen)
+@keyboards.register('back')
+def build_back_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text=catalog.translations[lang]['back'], callback_data="back_to_main")
+    return keyboard.as_markup()
+
+
+CATEGORIES_PER_PAGE = 8
+SERVICES_PER_PAGE = 8
+
+
+def page_count(total: int, per_page: int) -> int:
+    return max(1, (total + per_page - 1) // per_page)
+
+
+def clamp_page(page: int, total: int, per_page: int) -> int:
+    """Keep pages from old messages in range after the catalog changed"""
+    return min(max(page, 0), page_count(total, per_page) - 1)
+
+
+def add_page_buttons(keyboard: InlineKeyboardBuilder, page: int, pages: int, make_callback: Callable[[int], Any]) -> None:
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=make_callback(page - 1).pack()))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=make_callback(page + 1).pack()))
+    if buttons:
+        keyboard.row(*buttons)
+
+
+# Service categories, first level of service selection
+@keyboards.register('categories')
+def build_categories_keyboard(lang: str, catalog: Catalog, page: int) -> InlineKeyboardMarkup:
+    categories = catalog.categories
+    page = clamp_page(page, len(categories), CATEGORIES_PER_PAGE)
+    keyboard = InlineKeyboardBuilder()
+    start = page * CATEGORIES_PER_PAGE
+    for category in categories[start:start + CATEGORIES_PER_PAGE]:
+        keyboard.button(
+            text=category.names[lang],
+            callback_data=ServicePageCallback(category=category.category_id, page=0)
+        )
+    keyboard.adjust(2)
+    pages = page_count(len(categories), CATEGORIES_PER_PAGE)
+    add_page_buttons(keyboard, page, pages, lambda p: CategoryPageCallback(page=p))
+    keyboard.row(InlineKeyboardButton(text=catalog.translations[lang]['back'], callback_data="back_to_main"))
+    return keyboard.as_markup()
+
+
+# Services of one category with prices
+@keyboards.register('category_services')
+def build_category_services_keyboard(lang: str, catalog: Catalog, category_id: int, page: int) -> InlineKeyboardMarkup:
+    services = catalog.category(category_id).services[lang]
+    page = clamp_page(page, len(services), SERVICES_PER_PAGE)
+    keyboard = InlineKeyboardBuilder()
+    start = page * SERVICES_PER_PAGE
+    for service in services[start:start + SERVICES_PER_PAGE]:
+        keyboard.button(
+            text=f"{service.name} — {service.price}",
+            callback_data=ServiceCallback(category=service.category_id, service=service.service_id)
+        )
+    keyboard.adjust(1)
+    pages = page_count(len(services), SERVICES_PER_PAGE)
+    add_page_buttons(keyboard, page, pages, lambda p: ServicePageCallback(category=category_id, page=p))
+    # Back to the page of categories this one is on
+    keyboard.row(InlineKeyboardButton(
+        text=catalog.translations[lang]['back'],
+        callback_data=CategoryPageCallback(page=category_id // CATEGORIES_PER_PAGE).pack()
+    ))
+    return keyboard.as_markup()
+
+
+# Search results outside the appointment flow
+@keyboards.register('search')
+def build_search_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    texts = catalog.translations[lang]
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text=texts['appointment'], callback_data="start_appointment")
+    keyboard.button(text=texts['back_to_main'], callback_data="back_to_main")
+    keyboard.adjust(1)
+    return keyboard.as_markup()
+
+
+def build_service_results_keyboard(services: Iterable[Service], lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    """Search results to pick from during an appointment; depends on the query, so it isn't cached"""
+    keyboard = InlineKeyboardBuilder()
+    for service in services:
+        keyboard.button(
+            text=f"{service.name} — {service.price}",
+            callback_data=ServiceCallback(category=service.category_id, service=service.service_id)
+        )
+    keyboard.button(text=catalog.translations[lang]['back'], callback_data="back_to_main")
+    keyboard.adjust(1)
+    return keyboard.as_markup()
+
+
+def rows_of(buttons: List[InlineKeyboardButton], width: int) -> List[List[InlineKeyboardButton]]:
+    return [buttons[i:i + width] for i in range(0, len(buttons), width)]
+
+
+# Free days and times depend on bookings, so these two aren't cached; they
+# are built without InlineKeyboardBuilder, which is several times slower
+def build_days_keyboard(days: List[date], today: date, category_id: int, lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    texts = catalog.translations[lang]
+    names = {0: texts['today'], 1: texts['tomorrow'], 2: texts['day_after_tomorrow']}
+    buttons = [
+        InlineKeyboardButton(
+            text=names.get((day - today).days, day.strftime("%d.%m")),
+            callback_data=DayCallback(day=day.toordinal()).pack()
+        )
+        for day in days
+    ]
+    rows = rows_of(buttons, 3)
+    rows.append([InlineKeyboardButton(
+        text=texts['back'],
+        callback_data=ServicePageCallback(category=category_id, page=0).pack()
+    )])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def build_slots_keyboard(schedule: Schedule, day: date, slots: List[int], lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    ordinal = day.toordinal()
+    buttons = [
+        InlineKeyboardButton(text=schedule.slot_time(slot), callback_data=SlotCallback(day=ordinal, slot=slot).pack())
+        for slot in slots
+    ]
+    rows = rows_of(buttons, 4)
+    rows.append([InlineKeyboardButton(text=catalog.translations[lang]['back'], callback_data="pick_day")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+# Shown after an appointment is confirmed
+@keyboards.register('appointment_done')
+def build_appointment_done_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(
+        text=catalog.translations[lang]['make_another_appointment'],
+        callback_data="make_another_appointment"
+    )
+    return keyboard.as_markup()
+
+
+# Appointment confirmation keyboard
+@keyboards.register('confirmation')
+def build_confirmation_keyboard(lang: str, catalog: Catalog) -> InlineKeyboardMarkup:
+    texts = catalog.translations[lang]
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text=texts['make_another_appointment'], callback_data="make_another_appointment")
+    keyboard.button(text=texts['back_to_main'], callback_data="back_to_main")
+    return keyboard.as_markup()
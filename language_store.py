@@ -0,0 +1,280 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from db import open_db, state_path
+
+logger = logging.getLogger(__name__)
+
+# Marks users known to have no stored language, so they aren't looked up again
+_MISSING = object()
+
+
+class LanguageBackend:
+    """Durable storage for user languages. Methods are blocking and run in a worker thread."""
+
+    def load(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def save_many(self, items: List[Tuple[int, str]]) -> None:
+        raise NotImplementedError
+
+    def add_users(self, user_ids: List[int]) -> None:
+        """Remember users who started the bot, with or without a language"""
+        raise NotImplementedError
+
+    def iter_users(self, after: int, limit: int) -> List[Tuple[int, Optional[str]]]:
+        """Up to `limit` known users with ids above `after`, ordered by id, with their language"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteLanguageBackend(LanguageBackend):
+    """Languages stored in SQLite (WAL mode), sharded across files by user id"""
+
+    def __init__(self, shards: int = 4, filename: str = "languages_{shard}.sqlite3"):
+        self.shards = shards
+        self._conns = []
+        self._locks = []
+        for shard in range(shards):
+            conn = open_db(state_path(filename.format(shard=shard)))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_languages ("
+                "user_id INTEGER PRIMARY KEY, lang TEXT NOT NULL)"
+            )
+            created = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'known_users'").fetchone() is None
+            conn.execute("CREATE TABLE IF NOT EXISTS known_users (user_id INTEGER PRIMARY KEY)")
+            if created:
+                # Users from before known_users existed all picked a language
+                conn.execute("INSERT OR IGNORE INTO known_users (user_id) SELECT user_id FROM user_languages")
+            conn.commit()
+            self._conns.append(conn)
+            self._locks.append(threading.Lock())
+
+    def _shard(self, user_id: int) -> int:
+        return user_id % self.shards
+
+    def load(self, user_id: int) -> Optional[str]:
+        shard = self._shard(user_id)
+        with self._locks[shard]:
+            row = self._conns[shard].execute(
+                "SELECT lang FROM user_languages WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, items: List[Tuple[int, str]]) -> None:
+        by_shard: Dict[int, List[Tuple[int, str]]] = {}
+        for user_id, lang in items:
+            by_shard.setdefault(self._shard(user_id), []).append((user_id, lang))
+        for shard, rows in by_shard.items():
+            with self._locks[shard]:
+                conn = self._conns[shard]
+                conn.executemany(
+                    "INSERT INTO user_languages (user_id, lang) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET lang = excluded.lang",
+                    rows
+                )
+                conn.executemany("INSERT OR IGNORE INTO known_users (user_id) VALUES (?)", [(u,) for u, _ in rows])
+                conn.commit()
+
+    def add_users(self, user_ids: List[int]) -> None:
+        by_shard: Dict[int, List[Tuple[int]]] = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self._shard(user_id), []).append((user_id,))
+        for shard, rows in by_shard.items():
+            with self._locks[shard]:
+                conn = self._conns[shard]
+                conn.executemany("INSERT OR IGNORE INTO known_users (user_id) VALUES (?)", rows)
+                conn.commit()
+
+    def iter_users(self, after: int, limit: int) -> List[Tuple[int, Optional[str]]]:
+        chunks = []
+        for lock, conn in zip(self._locks, self._conns):
+            with lock:
+                chunks.append(conn.execute(
+                    "SELECT k.user_id, l.lang FROM known_users k LEFT JOIN user_languages l USING (user_id) "
+                    "WHERE k.user_id > ? ORDER BY k.user_id LIMIT ?",
+                    (after, limit)
+                ).fetchall())
+        # Every shard is sorted by id, so merging them keeps the global order
+        return list(itertools.islice(heapq.merge(*chunks), limit))
+
+    def close(self) -> None:
+        for lock, conn in zip(self._locks, self._conns):
+            with lock:
+                conn.close()
+
+
+class RedisLanguageBackend(LanguageBackend):
+    """Languages stored in Redis or any server speaking its protocol.
+
+    Lets bot processes on several machines share user languages. Needs the
+    `redis` package, which is only imported when this backend is used.
+    """
+
+    def __init__(self, url: str, prefix: str = "medbot:lang:", users_key: str = "medbot:users"):
+        import redis
+
+        self.prefix = prefix
+        self.users_key = users_key
+        self._client = redis.Redis.from_url(url)
+
+    def load(self, user_id: int) -> Optional[str]:
+        value = self._client.get(f"{self.prefix}{user_id}")
+        return value.decode() if value is not None else None
+
+    def save_many(self, items: List[Tuple[int, str]]) -> None:
+        pipeline = self._client.pipeline()
+        pipeline.mset({f"{self.prefix}{user_id}": lang for user_id, lang in items})
+        pipeline.zadd(self.users_key, {user_id: user_id for user_id, _ in items})
+        pipeline.execute()
+
+    def add_users(self, user_ids: List[int]) -> None:
+        # A sorted set scored by user id, so users can be read in id order
+        self._client.zadd(self.users_key, {user_id: user_id for user_id in user_ids})
+
+    def iter_users(self, after: int, limit: int) -> List[Tuple[int, Optional[str]]]:
+        user_ids = [int(u) for u in self._client.zrangebyscore(self.users_key, f"({after}", "+inf", start=0, num=limit)]
+        if not user_ids:
+            return []
+        langs = self._client.mget([f"{self.prefix}{user_id}" for user_id in user_ids])
+        return [(user_id, lang.decode() if lang is not None else None) for user_id, lang in zip(user_ids, langs)]
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class LanguageStore:
+    """In-memory LRU of user languages in front of a durable backend.
+
+    Reads are plain dict lookups. Users are loaded lazily by LanguageMiddleware
+    before their update is handled, and writes are batched by a background task.
+    """
+
+    def __init__(
+        self,
+        backend: LanguageBackend,
+        capacity: int = 50_000,
+        flush_interval: float = 1.0,
+        batch_size: int = 500
+    ):
+        self.backend = backend
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cache: "OrderedDict[int, Any]" = OrderedDict()
+        self._pending: Dict[int, str] = {}
+        self._new_users: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def get(self, user_id: int, default: str = 'ru') -> str:
+        lang = self._cache.get(user_id)
+        if lang is None:
+            return self._pending.get(user_id, default)
+        if lang is _MISSING:
+            return default
+        self._cache.move_to_end(user_id)
+        return lang
+
+    def set(self, user_id: int, lang: str) -> None:
+        self._remember(user_id, lang)
+        self._pending[user_id] = lang
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def add_user(self, user_id: int) -> None:
+        """Remember a user who started the bot, so announcements reach them"""
+        if self._cache.get(user_id, _MISSING) is _MISSING and user_id not in self._pending:
+            self._new_users.add(user_id)
+
+    async def users(self, after: int = 0, limit: int = 500) -> List[Tuple[int, Optional[str]]]:
+        """A chunk of known users ordered by id; pass the last id seen as `after` for the next one"""
+        return await asyncio.to_thread(self.backend.iter_users, after, limit)
+
+    def _remember(self, user_id: int, value: Any) -> None:
+        self._cache[user_id] = value
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    async def load(self, user_id: int) -> None:
+        """Make sure the user's language is in memory"""
+        if user_id in self._cache or user_id in self._pending:
+            return
+        lang = await asyncio.to_thread(self.backend.load, user_id)
+        # The user may have picked a language while we were reading
+        if user_id not in self._cache:
+            self._remember(user_id, _MISSING if lang is None else lang)
+
+    async def flush(self) -> None:
+        if self._new_users:
+            user_ids = list(self._new_users)
+            self._new_users = set()
+            try:
+                await asyncio.to_thread(self.backend.add_users, user_ids)
+            except Exception as e:
+                logger.error(f"Failed to persist {len(user_ids)} new users: {e}")
+                self._new_users.update(user_ids)
+        if not self._pending:
+            return
+        items = list(self._pending.items())
+        self._pending = {}
+        try:
+            await asyncio.to_thread(self.backend.save_many, items)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(items)} user languages: {e}")
+            # Keep newer values that arrived meanwhile
+            for user_id, lang in items:
+                self._pending.setdefault(user_id, lang)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        self.backend.close()
+
+
+class LanguageMiddleware(BaseMiddleware):
+    """Loads the user's language before the update reaches the handlers"""
+
+    def __init__(self, store: LanguageStore):
+        self.store = store
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is not None:
+            await self.store.load(user.id)
+        return await handler(event, data)
@@ -0,0 +1,224 @@
+"""Append-only ledger of completed appointments.
+
+Can also be used from the command line:
+
+    python ledger.py export --format csv --output appointments.csv
+    python ledger.py find --phone +998991234567
+    python ledger.py stats --days 30
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from db import open_db, state_path
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    'id', 'created_at', 'day', 'user_id', 'name', 'phone',
+    'category_id', 'service_id', 'service', 'price', 'lang',
+)
+
+
+class AppointmentLedger:
+    """SQLite store of appointments with per-day aggregates.
+
+    record() only appends to an in-memory batch; a background task writes
+    batches in one transaction and updates the daily_stats table with them.
+    """
+
+    def __init__(self, path: Optional[str] = None, flush_interval: float = 1.0, batch_size: int = 200):
+        self.path = path or state_path("appointments.sqlite3")
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._conn = open_db(self.path)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS appointments ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, day TEXT NOT NULL, "
+            "user_id INTEGER, name TEXT, phone TEXT, category_id INTEGER, service_id INTEGER, "
+            "service TEXT NOT NULL, price TEXT, lang TEXT);"
+            "CREATE INDEX IF NOT EXISTS appointments_phone ON appointments (phone);"
+            "CREATE INDEX IF NOT EXISTS appointments_service ON appointments (service);"
+            "CREATE INDEX IF NOT EXISTS appointments_created_at ON appointments (created_at);"
+            "CREATE TABLE IF NOT EXISTS daily_stats ("
+            "day TEXT NOT NULL, service TEXT NOT NULL, count INTEGER NOT NULL, "
+            "PRIMARY KEY (day, service));"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._batch: List[Tuple[Any, ...]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        user_id: int,
+        name: str,
+        phone: str,
+        category_id: int,
+        service_id: int,
+        service: str,
+        price: str,
+        lang: str
+    ) -> None:
+        """Queue an appointment for writing; never blocks"""
+        now = time.time()
+        day = datetime.fromtimestamp(now).date().isoformat()
+        self._batch.append((now, day, user_id, name, phone, category_id, service_id, service, price, lang))
+        if len(self._batch) >= self.batch_size:
+            self._wakeup.set()
+
+    def _write(self, rows: List[Tuple[Any, ...]]) -> None:
+        counts: Dict[Tuple[str, str], int] = {}
+        for row in rows:
+            key = (row[1], row[7])
+            counts[key] = counts.get(key, 0) + 1
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO appointments (created_at, day, user_id, name, phone, category_id, "
+                    "service_id, service, price, lang) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.executemany(
+                    "INSERT INTO daily_stats (day, service, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT(day, service) DO UPDATE SET count = count + excluded.count",
+                    [(day, service, count) for (day, service), count in counts.items()]
+                )
+
+    async def flush(self) -> None:
+        if not self._batch:
+            return
+        rows, self._batch = self._batch, []
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rows)} appointments to the ledger: {e}")
+            self._batch = rows + self._batch
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    # Queries (blocking, call through asyncio.to_thread from handlers)
+
+    def daily_stats(self, days: int = 7) -> List[Tuple[str, str, int]]:
+        """(day, service, count) for the last `days` days, newest first"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT day, service, count FROM daily_stats WHERE day >= ? ORDER BY day DESC, count DESC",
+                (since,)
+            ).fetchall()
+
+    def iter_rows(self, query: str = "", params: Tuple[Any, ...] = (), chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Stream appointments in chunks over a separate read-only connection"""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM appointments {query} ORDER BY id", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(COLUMNS, row))
+        finally:
+            conn.close()
+
+    def find_by_phone(self, phone: str) -> List[Dict[str, Any]]:
+        return list(self.iter_rows("WHERE phone = ?", (phone,)))
+
+    def export(self, out: TextIO, fmt: str = 'csv', chunk_size: int = 1000) -> int:
+        """Write every appointment to `out` as CSV or a JSON array; return the number of rows"""
+        count = 0
+        if fmt == 'csv':
+            writer = csv.DictWriter(out, fieldnames=COLUMNS)
+            writer.writeheader()
+            for row in self.iter_rows(chunk_size=chunk_size):
+                writer.writerow(row)
+                count += 1
+        elif fmt == 'json':
+            out.write('[')
+            for row in self.iter_rows(chunk_size=chunk_size):
+                out.write(',\n' if count else '\n')
+                out.write(json.dumps(row, ensure_ascii=False))
+                count += 1
+            out.write('\n]\n')
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+        return count
+
+
+def format_stats(rows: List[Tuple[str, str, int]]) -> str:
+    """Human readable /stats report"""
+    if not rows:
+        return "📊 Записей пока нет"
+    lines = ["📊 Записи по дням"]
+    current_day = None
+    for day, service, count in rows:
+        if day != current_day:
+            total = sum(c for d, _, c in rows if d == day)
+            lines.append(f"\n📅 {day}: {total}")
+            current_day = day
+        lines.append(f"  • {service}: {count}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="export all appointments")
+    export_parser.add_argument('--format', choices=('csv', 'json'), default='csv')
+    export_parser.add_argument('--output', help="output file (default: stdout)")
+    find_parser = commands.add_parser('find', help="find appointments by phone")
+    find_parser.add_argument('--phone', required=True)
+    stats_parser = commands.add_parser('stats', help="bookings per service per day")
+    stats_parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+
+    ledger = AppointmentLedger()
+    if args.command == 'export':
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8', newline='') as f:
+                count = ledger.export(f, args.format)
+            print(f"Exported {count} appointments to {args.output}", file=sys.stderr)
+        else:
+            ledger.export(sys.stdout, args.format)
+    elif args.command == 'find':
+        for row in ledger.find_by_phone(args.phone):
+            print(json.dumps(row, ensure_ascii=False))
+    elif args.command == 'stats':
+        print(format_stats(ledger.daily_stats(args.days)))
+
+
+if __name__ == "__main__":
+    main()
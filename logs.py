@@ -0,0 +1,199 @@
+"""Logging that never blocks the event loop.
+
+Handlers only put records on a queue; a background thread formats them as
+JSON lines and writes them out, so a slow terminal, pipe or log collector
+cannot stall update handling. Records logged while an update is handled
+carry its update id, user id, handler name and the time since the update
+arrived. Info records of the per-update loggers can be sampled.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, Optional, TextIO
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# One line per update; aiogram logs one more ("Update id=... is handled")
+updates_logger = logging.getLogger('medbot.updates')
+SAMPLED_LOGGERS = ('medbot.updates', 'aiogram.event')
+
+# Fields of the update being handled, shared by everything it awaits
+_update_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar('update_context', default=None)
+
+_RECORD_FIELDS = ('update_id', 'user_id', 'handler', 'duration_ms', 'sample_rate')
+
+
+def set_handler(name: str) -> None:
+    """Record which handler is handling the current update"""
+    context = _update_context.get()
+    if context is not None:
+        context['handler'] = name
+
+
+class ContextQueueHandler(QueueHandler):
+    """Puts records on the queue with the current update's fields attached.
+
+    Runs on the logging thread (the event loop), so it does as little as
+    possible: the message is merged here because its arguments may change
+    later, everything else is formatted by the listener thread.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        context = _update_context.get()
+        if context is not None:
+            record.update_id = context['update_id']
+            record.user_id = context['user_id']
+            record.handler = context['handler']
+            record.duration_ms = round((time.perf_counter() - context['started']) * 1000, 2)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Dropping is better than waiting for the writer thread
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps `rate` of the info records of SAMPLED_LOGGERS; warnings always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or record.name not in SAMPLED_LOGGERS:
+            return True
+        if self.rate < 1.0 and random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in _RECORD_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format with the update fields appended"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = ' '.join(
+            f"{field}={getattr(record, field)}" for field in _RECORD_FIELDS if getattr(record, field, None) is not None
+        )
+        return f"{line} [{fields}]" if fields else line
+
+
+class LogListener(QueueListener):
+    """QueueListener that may be stopped again, e.g. explicitly and then at exit"""
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    json_format: bool = True,
+    sample_rate: float = 1.0,
+    stream: Optional[TextIO] = None,
+    queue_size: int = 10000
+) -> LogListener:
+    """Route all logging through a queue to a writer thread; returns the started listener"""
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if json_format else TextFormatter())
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = LogListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Write out what is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging_from_env() -> LogListener:
+    """setup_logging() as configured by LOG_LEVEL, LOG_FORMAT=text and LOG_SAMPLE_RATE"""
+    return setup_logging(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        json_format=os.getenv("LOG_FORMAT", "json") != "text",
+        sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "1"))
+    )
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Sets the log fields of an update and logs its duration (outer middleware on dp.update)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        user = data.get('event_from_user')
+        context = {
+            'update_id': event.update_id,
+            'user_id': user.id if user else None,
+            'handler': None,
+            # Stamped by SchedulingDispatcher before the update waited for
+            # its user and a free slot, so durations include that wait
+            'started': data.get('update_received') or time.perf_counter(),
+        }
+        token = _update_context.set(context)
+        try:
+            result = await handler(event, data)
+            updates_logger.info(f"{event.event_type} handled")
+            return result
+        except Exception:
+            # aiogram logs the traceback, without the update fields
+            updates_logger.warning(f"{event.event_type} failed")
+            raise
+        finally:
+            _update_context.reset(token)
@@ -1,161 +1,325 @@
+import argparse
+import asyncio
 import os
-import json
 import logging
 import sys
-import ssl
-import certifi
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton, ReplyKeyboardMarkup, FSInputFile
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram import Bot, F, types
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiohttp import ClientTimeout, ClientSession, TCPConnector, ClientError
-from aiohttp.client import _RequestContextManager
 from appointment import (
+    ADMIN_ID,
+    ADMIN_IDS,
     AppointmentStates,
+    admin_outbox,
+    appointment_ledger,
     start_appointment,
     process_name,
     process_phone,
-    process_service_selection
+    process_service_selection,
+    process_day_selection,
+    process_slot_selection,
+    slot_index
 )
-
-# Force output to console
-print("Starting bot initialization...")
-
-# Set up logging with more detailed format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ],
-    force=True  # Force reconfiguration of the root logger
+from media_cache import MediaCache
+from media import MediaIndex, resolve_video, video_variants
+from language_store import LanguageStore, LanguageMiddleware, RedisLanguageBackend, SQLiteLanguageBackend
+from fsm_storage import SQLiteStorage, FSMFlushMiddleware
+from callbacks import (
+    CallbackRouter,
+    CategoryPageCallback,
+    ContactCallback,
+    DayCallback,
+    LanguageCallback,
+    ServiceCallback,
+    ServicePageCallback,
+    SlotCallback
+)
+from keyboards import (
+    CATEGORIES_PER_PAGE,
+    SERVICES_PER_PAGE,
+    build_service_results_keyboard,
+    clamp_page,
+    keyboards,
+    page_count
 )
+from catalog import CatalogWatcher, get_catalog
+from session import BotSession
+from aiogram.client.telegram import TelegramAPIServer
+from ratelimit import RateLimiter
+from antiflood import Antiflood
+from logs import LogContextMiddleware, setup_logging_from_env
+from scheduler import SchedulingDispatcher, UpdateScheduler
+from ledger import format_stats
+from broadcast import Broadcaster, format_job, render
+from metrics import (
+    ApiMetricsMiddleware,
+    Gauge,
+    HandlerMetricsMiddleware,
+    MetricsServer,
+    UpdateMetricsMiddleware,
+    registry as metrics_registry
+)
+
+# Load environment variables, including the LOG_* settings below
+load_dotenv()
+
+# Log records go through a queue to a writer thread, so writing them never
+# blocks the event loop; JSON lines unless LOG_FORMAT=text
+log_listener = setup_logging_from_env()
 logger = logging.getLogger(__name__)
+logger.info("Starting bot initialization...")
 
-# User language storage (in production, use a database)
-user_languages = {}
+# Videos sent from the contacts menu: data/videos/{name}_{lang}.mp4,
+# falling back to data/videos/{name}.mp4
+LOCATION_VIDEO = "location"
+CLINIC_VIDEO = "clinic"
 
-# Load environment variables
-print("Loading environment variables...")
-logger.info("Loading environment variables...")
-load_dotenv()
+# Duration, dimensions and thumbnails of the videos (python media.py scan)
+media_index = MediaIndex()
+
+# Telegram file_id cache, so each video is uploaded only once
+media_cache = MediaCache(index=media_index)
 
 # Get token from environment variable
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     error_msg = "Error: BOT_TOKEN not found in environment variables!"
-    print(error_msg)
     logger.error(error_msg)
     raise ValueError(error_msg)
 
 # Validate token format
 if ":" not in BOT_TOKEN:
     error_msg = "Error: Invalid BOT_TOKEN format! Token should contain ':'"
-    print(error_msg)
     logger.error(error_msg)
     raise ValueError(error_msg)
 
-print("Bot token loaded successfully")
 logger.info("Bot token loaded successfully")
 
 # Initialize dispatcher
-print("Initializing dispatcher...")
 logger.info("Initializing dispatcher...")
-dp = Dispatcher()
-
-# Load data files
-print("Loading data files...")
-logger.info("Loading data files...")
-try:
-    with open('data/translations.json', 'r', encoding='utf-8') as f:
-        translations = json.load(f)
-        print("Translations loaded successfully")
-        logger.info("Translations loaded successfully")
-
-    with open('data/services.json', 'r', encoding='utf-8') as f:
-        services = json.load(f)
-        print("Services loaded successfully")
-        logger.info("Services loaded successfully")
-
-    with open('data/contacts.json', 'r', encoding='utf-8') as f:
-        contacts = json.load(f)
-        print("Contacts loaded successfully")
-        logger.info("Contacts loaded successfully")
-except Exception as e:
-    print(f"Error loading data files: {e}")
-    logger.error(f"Error loading data files: {e}")
-    raise
+# Shared state: SQLite files in STATE_DIR by default, which all processes on
+# one machine can share (see cluster.py), or a Redis server for several machines
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    from aiogram.fsm.storage.redis import RedisStorage
+    language_store = LanguageStore(RedisLanguageBackend(REDIS_URL))
+    fsm_storage = RedisStorage.from_url(REDIS_URL, state_ttl=24 * 60 * 60, data_ttl=24 * 60 * 60)
+else:
+    # User language storage: in-memory LRU backed by sharded SQLite files
+    language_store = LanguageStore(SQLiteLanguageBackend())
+    fsm_storage = SQLiteStorage()
+# Different users are handled concurrently, one user's updates strictly in order
+update_scheduler = UpdateScheduler(
+    max_concurrency=int(os.getenv("MAX_CONCURRENT_UPDATES", "64")),
+    max_pending=int(os.getenv("MAX_PENDING_UPDATES", "1000"))
+)
+# Per-user flood control and load shedding; checked before an update waits
+# for its user's lock or a concurrency slot
+antiflood = Antiflood(
+    language_store,
+    rate=float(os.getenv("ANTIFLOOD_RATE", "2")),
+    burst=int(os.getenv("ANTIFLOOD_BURST", "10")),
+    dedupe_window=float(os.getenv("ANTIFLOOD_DEDUPE_WINDOW", "1")),
+    shed_depth=int(os.getenv("SHED_QUEUE_DEPTH", "500")),
+    depth=lambda: update_scheduler.queued - update_scheduler.running
+)
+dp = SchedulingDispatcher(update_scheduler, gate=antiflood.check, storage=fsm_storage)
+dp.shutdown.register(antiflood.close)
+# Update id, user id and handler name on every log record of an update
+dp.update.outer_middleware(LogContextMiddleware())
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.update.outer_middleware(LanguageMiddleware(language_store))
+if isinstance(fsm_storage, SQLiteStorage):
+    dp.update.outer_middleware(FSMFlushMiddleware(fsm_storage))
+    dp.startup.register(fsm_storage.start)
+dp.startup.register(language_store.start)
+dp.shutdown.register(language_store.close)
+# Announcements to all users, resumed after restarts
+broadcaster = Broadcaster(language_store)
+# In a cluster only one worker sends the admin notifications and broadcasts
+if os.getenv("OUTBOX_SENDER", "1") == "1":
+    dp.startup.register(admin_outbox.start)
+    dp.startup.register(broadcaster.start)
+dp.shutdown.register(admin_outbox.close)
+dp.shutdown.register(broadcaster.close)
+dp.startup.register(appointment_ledger.start)
+dp.shutdown.register(appointment_ledger.close)
+dp.startup.register(slot_index.start)
+dp.shutdown.register(slot_index.close)
+
+# Reload translations, services and contacts when the files change
+catalog_watcher = CatalogWatcher()
+dp.startup.register(catalog_watcher.start)
+dp.shutdown.register(catalog_watcher.close)
+
+# Keeps outgoing Bot API calls within Telegram's flood limits
+rate_limiter = RateLimiter(
+    global_rate=float(os.getenv("RATE_LIMIT_GLOBAL", "30")),
+    per_chat_rate=float(os.getenv("RATE_LIMIT_PER_CHAT", "1"))
+)
+
+# Prometheus-style metrics, served when METRICS_PORT is set
+metrics_registry.register(Gauge("bot_updates_pending", "Admitted updates not finished yet", lambda: update_scheduler.pending))
+metrics_registry.register(Gauge("bot_updates_running", "Updates being handled", lambda: update_scheduler.running))
+metrics_registry.register(Gauge(
+    "bot_updates_waiting", "Updates waiting for their user or a free slot",
+    lambda: update_scheduler.queued - update_scheduler.running
+))
+if os.getenv("METRICS_PORT"):
+    metrics_server = MetricsServer(os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT")))
+    dp.startup.register(metrics_server.start)
+    dp.shutdown.register(metrics_server.close)
+
+# Index new or changed videos in the background (needs ffprobe)
+async def refresh_media_index():
+    await media_index.start(video_variants((LOCATION_VIDEO, CLINIC_VIDEO), get_catalog().languages))
+
+dp.startup.register(refresh_media_index)
+dp.shutdown.register(media_index.close)
+
+async def prewarm_videos(bot):
+    variants = await asyncio.to_thread(video_variants, (LOCATION_VIDEO, CLINIC_VIDEO), get_catalog().languages)
+    for video_path, langs in variants.items():
+        await media_cache.prewarm(bot, ADMIN_ID, [video_path], langs)
+
+# All callback queries go through one handler that routes by callback data
+callback_router = CallbackRouter()
+dp.callback_query.register(callback_router.dispatch)
+
+# Load data files and build keyboards; run in a thread from main() while
+# the bot connects, handlers load the catalog on demand otherwise
+def load_data():
+    logger.info("Loading data files...")
+    try:
+        catalog = get_catalog()
+        logger.info("Data files loaded successfully")
+    except Exception as e:
+        logger.error(f"Error loading data files: {e}")
+        raise
+
+    # Build keyboards before the first update arrives
+    for screen in ('language', 'main_menu', 'contacts', 'call', 'back', 'search', 'appointment_done', 'confirmation'):
+        keyboards.warm(screen, catalog.languages)
+    keyboards.warm('categories', catalog.languages, 0)
 
 # Language selection keyboard
 def get_language_keyboard():
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text="Русский 🇷🇺", callback_data="lang_ru")
-    keyboard.button(text="O'zbek 🇺🇿", callback_data="lang_uz")
-    return keyboard.as_markup()
+    return keyboards.get('language', 'any')
 
 # Main menu keyboard
 def get_main_menu_keyboard(lang):
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text=translations[lang]['contacts'], callback_data="show_contacts")
-    keyboard.button(text=translations[lang]['appointment'], callback_data="start_appointment")
-    keyboard.button(text=translations[lang]['about_clinic'], callback_data="about_clinic")
-    return keyboard.as_markup()
+    return keyboards.get('main_menu', lang)
 
 # Start command handler
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
+    # Everyone who started the bot receives announcements
+    language_store.add_user(message.from_user.id)
     await message.answer(
         "Выберите язык / Tilni tanlang",
         reply_markup=get_language_keyboard()
     )
 
+# Admin statistics handler
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    rows = await asyncio.to_thread(appointment_ledger.daily_stats, 7)
+    await message.answer(format_stats(rows))
+
+# Admin announcements: /broadcast <translation key or text>, /broadcast status, /broadcast cancel
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    args = (command.args or '').strip()
+    if not args:
+        await message.answer(
+            "📣 /broadcast <ключ из translations.json или текст>\n"
+            "/broadcast status — ход рассылки\n"
+            "/broadcast cancel — остановить рассылку"
+        )
+    elif args == 'status':
+        job = await broadcaster.latest()
+        await message.answer(format_job(job) if job else "📣 Рассылок пока не было")
+    elif args == 'cancel':
+        job_id = await broadcaster.cancel()
+        await message.answer(f"📣 Рассылка #{job_id} остановлена" if job_id else "📣 Нет активной рассылки")
+    else:
+        job_id = await broadcaster.create(message.from_user.id, render(get_catalog().translations, args))
+        await message.answer(f"📣 Рассылка #{job_id} поставлена в очередь")
+
+# Service search: /search <query>, or plain text while choosing a service
+async def answer_search(message: types.Message, query: str, state: FSMContext):
+    lang = language_store.get(message.from_user.id, 'ru')
+    catalog = get_catalog()
+    texts = catalog.translations[lang]
+    services = catalog.search(query, lang)
+    if not services:
+        await message.answer(texts['search_no_results'])
+        return
+    if await state.get_state() == AppointmentStates.waiting_for_service.state:
+        # The patient can book a result right away
+        await message.answer(
+            texts['search_results'],
+            reply_markup=build_service_results_keyboard(services, lang, catalog)
+        )
+        return
+    lines = [texts['search_results']]
+    lines.extend(f"• {service.name} — {service.price}" for service in services)
+    await message.answer("\n".join(lines), reply_markup=keyboards.get('search', lang, catalog))
+
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext):
+    if not command.args:
+        lang = language_store.get(message.from_user.id, 'ru')
+        await message.answer(get_catalog().translations[lang]['search_prompt'])
+        return
+    await answer_search(message, command.args, state)
+
 # Language selection handler
-@dp.callback_query(lambda c: c.data.startswith('lang_'))
-async def process_language_selection(callback: types.CallbackQuery):
-    lang = callback.data.split('_')[1]
+@callback_router.route(LanguageCallback)
+async def process_language_selection(callback: types.CallbackQuery, callback_data: LanguageCallback):
+    lang = callback_data.lang
     user_id = callback.from_user.id
+    catalog = get_catalog()
     
     # Store user's language preference
-    user_languages[user_id] = lang
+    language_store.set(user_id, lang)
     
     await callback.message.answer(
-        translations[lang]['welcome'],
-        reply_markup=get_main_menu_keyboard(lang)
+        catalog.translations[lang]['welcome'],
+        reply_markup=keyboards.get('main_menu', lang, catalog)
     )
     await callback.answer()
 
 # Contacts handler
-@dp.callback_query(lambda c: c.data == "show_contacts")
+@callback_router.exact("show_contacts")
 async def show_contacts(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    lang = user_languages.get(user_id, 'ru')
-    
-    keyboard = InlineKeyboardBuilder()
-    # Add buttons in a column
-    keyboard.button(text=translations[lang]['location'], callback_data="contact_location")
-    keyboard.button(text=translations[lang]['video'], callback_data="contact_video")
-    keyboard.button(text=translations[lang]['call'], callback_data="contact_call")
-    keyboard.button(text=translations[lang]['back'], callback_data="back_to_main")
+    lang = language_store.get(user_id, 'ru')
+    catalog = get_catalog()
     
     await callback.message.edit_text(
-        translations[lang]['contact_info'],
-        reply_markup=keyboard.as_markup()
+        catalog.translations[lang]['contact_info'],
+        reply_markup=keyboards.get('contacts', lang, catalog)
     )
     await callback.answer()
 
 # Contact information handlers
-@dp.callback_query(lambda c: c.data.startswith('contact_'))
-async def process_contact_info(callback: types.CallbackQuery):
-    info_type = callback.data.split('_')[1]
+@callback_router.route(ContactCallback)
+async def process_contact_info(callback: types.CallbackQuery, callback_data: ContactCallback):
+    info_type = callback_data.kind
     user_id = callback.from_user.id
-    lang = user_languages.get(user_id, 'ru')
+    lang = language_store.get(user_id, 'ru')
+    catalog = get_catalog()
     
     try:
         if info_type == 'location':
-            location = contacts[lang]['location']
+            location = catalog.contacts[lang]['location']
             try:
                 # Send location first
                 await callback.message.answer_location(
@@ -163,86 +327,83 @@ async def process_contact_info(callback: types.CallbackQuery):
                     longitude=location['longitude']
                 )
                 # Then send caption
-                await callback.message.answer(translations[lang]['location_caption'])
+                await callback.message.answer(catalog.translations[lang]['location_caption'])
                 
                 # Also send video
-                video_path = f"data/videos/location.mp4"
-                if os.path.exists(video_path):
-                    video_file = FSInputFile(video_path)
-                    await callback.message.answer_video(
-                        video=video_file,
-                        caption=translations[lang]['video_caption']
+                video_path = await asyncio.to_thread(resolve_video, LOCATION_VIDEO, lang, catalog.languages)
+                if video_path:
+                    await media_cache.send_video(
+                        callback.message,
+                        video_path,
+                        lang,
+                        caption=catalog.translations[lang]['video_caption']
                     )
                 else:
-                    await callback.message.answer(f"⚠️ Видео недоступно: {video_path}")
+                    await callback.message.answer(f"⚠️ Видео недоступно: {LOCATION_VIDEO}")
             except Exception as e:
-                print(f"Error sending location/video: {e}")
+                logger.error(f"Error sending location/video to {user_id}: {e}")
                 await callback.message.answer(f"⚠️ Ошибка при отправке: {str(e)}")
                 
         elif info_type == 'video':
             try:
-                video_path = f"data/videos/clinic.mp4"
-                if os.path.exists(video_path):
-                    video_file = FSInputFile(video_path)
-                    await callback.message.answer_video(
-                        video=video_file,
-                        caption=translations[lang]['video_caption']
+                video_path = await asyncio.to_thread(resolve_video, CLINIC_VIDEO, lang, catalog.languages)
+                if video_path:
+                    await media_cache.send_video(
+                        callback.message,
+                        video_path,
+                        lang,
+                        caption=catalog.translations[lang]['video_caption']
                     )
                 else:
-                    await callback.message.answer(f"⚠️ Видео недоступно: {video_path}")
+                    await callback.message.answer(f"⚠️ Видео недоступно: {CLINIC_VIDEO}")
             except Exception as e:
-                print(f"Error sending video: {e}")
+                logger.error(f"Error sending video to {user_id}: {e}")
                 await callback.message.answer(f"⚠️ Ошибка при отправке видео: {str(e)}")
                 
         elif info_type == 'call':
-            phone = contacts[lang]['phone']
-            # Format phone number for URL (remove spaces)
-            formatted_phone = phone.replace(" ", "")
-            keyboard = InlineKeyboardBuilder()
-            keyboard.button(text=translations[lang]['call'], url=f"tg://resolve?phone={formatted_phone.lstrip('+')}")
+            phone = catalog.contacts[lang]['phone']
             await callback.message.answer(
                 f"📞 {phone}",
-                reply_markup=keyboard.as_markup()
+                reply_markup=keyboards.get('call', lang, catalog)
             )
         
         await callback.answer()
     except Exception as e:
-        print(f"Error in contact handler: {e}")
+        logger.error(f"Error in contact handler ({info_type}) for {user_id}: {e}")
         await callback.message.answer(f"⚠️ Произошла ошибка: {str(e)}")
         await callback.answer()
 
 # About clinic handler
-@dp.callback_query(lambda c: c.data == "about_clinic")
+@callback_router.exact("about_clinic")
 async def about_clinic(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    lang = user_languages.get(user_id, 'ru')
-    
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text=translations[lang]['back'], callback_data="back_to_main")
+    lang = language_store.get(user_id, 'ru')
+    catalog = get_catalog()
     
     await callback.message.edit_text(
-        translations[lang]['about_clinic_text'],
-        reply_markup=keyboard.as_markup()
+        catalog.translations[lang]['about_clinic_text'],
+        reply_markup=keyboards.get('back', lang, catalog)
     )
     await callback.answer()
 
 # Back button handlers
-@dp.callback_query(lambda c: c.data == "back_to_main")
+@callback_router.exact("back_to_main")
 async def back_to_main(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    lang = user_languages.get(user_id, 'ru')
+    lang = language_store.get(user_id, 'ru')
+    catalog = get_catalog()
     
     await callback.message.edit_text(
-        translations[lang]['welcome'],
-        reply_markup=get_main_menu_keyboard(lang)
+        catalog.translations[lang]['welcome'],
+        reply_markup=keyboards.get('main_menu', lang, catalog)
     )
     await callback.answer()
 
 # Appointment handler
-@dp.callback_query(lambda c: c.data == "start_appointment")
+@callback_router.exact("start_appointment")
 async def appointment_start_callback(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
-    lang = user_languages.get(user_id, 'ru')
+    lang = language_store.get(user_id, 'ru')
     await start_appointment(callback.message, state, lang)
     await callback.answer()
 
@@ -250,54 +411,155 @@ async def appointment_start_callback(callback: types.CallbackQuery, state: FSMCo
 @dp.message(AppointmentStates.waiting_for_name)
 async def appointment_name(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    lang = user_languages.get(user_id, 'ru')
+    lang = language_store.get(user_id, 'ru')
     await process_name(message, state, lang)
 
 @dp.message(AppointmentStates.waiting_for_phone)
 async def appointment_phone(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    lang = user_languages.get(user_id, 'ru')
+    lang = language_store.get(user_id, 'ru')
     await process_phone(message, state, lang)
 
-@dp.callback_query(lambda c: c.data == "make_another_appointment")
+@callback_router.exact("make_another_appointment")
 async def make_another_appointment(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
-    lang = user_languages.get(user_id, 'ru')
+    lang = language_store.get(user_id, 'ru')
     await start_appointment(callback.message, state, lang)
     await callback.answer()
 
-async def main():
+def page_title(title, page, pages):
+    return f"{title} ({page + 1}/{pages})" if pages > 1 else title
+
+# Service browsing: pages are edited in place instead of sending new messages
+@callback_router.route(CategoryPageCallback)
+async def show_categories(callback: types.CallbackQuery, callback_data: CategoryPageCallback):
+    lang = language_store.get(callback.from_user.id, 'ru')
+    catalog = get_catalog()
+    total = len(catalog.categories)
+    page = clamp_page(callback_data.page, total, CATEGORIES_PER_PAGE)
+    await callback.message.edit_text(
+        page_title(catalog.translations[lang]['select_service'], page, page_count(total, CATEGORIES_PER_PAGE)),
+        reply_markup=keyboards.get('categories', lang, catalog, page)
+    )
+    await callback.answer()
+
+@callback_router.route(ServicePageCallback)
+async def show_category_services(callback: types.CallbackQuery, callback_data: ServicePageCallback, state: FSMContext):
+    lang = language_store.get(callback.from_user.id, 'ru')
+    catalog = get_catalog()
+    category = catalog.category(callback_data.category)
+    if category is None:
+        # Button from before a catalog reload
+        await callback.answer(catalog.translations[lang]['error_occurred'])
+        return
+    # "Back" from the days of a booking: the patient picks a service again
+    if await state.get_state() in (AppointmentStates.waiting_for_date.state, AppointmentStates.waiting_for_time.state):
+        await state.set_state(AppointmentStates.waiting_for_service)
+    total = len(category.services[lang])
+    page = clamp_page(callback_data.page, total, SERVICES_PER_PAGE)
+    await callback.message.edit_text(
+        page_title(f"🏥 {category.names[lang]}", page, page_count(total, SERVICES_PER_PAGE)),
+        reply_markup=keyboards.get('category_services', lang, catalog, category.category_id, page)
+    )
+    await callback.answer()
+
+@callback_router.route(ServiceCallback)
+async def appointment_service(callback: types.CallbackQuery, callback_data: ServiceCallback, state: FSMContext):
+    user_id = callback.from_user.id
+    lang = language_store.get(user_id, 'ru')
+    await process_service_selection(callback, state, lang, callback_data.category, callback_data.service)
+
+@callback_router.route(DayCallback)
+async def appointment_day(callback: types.CallbackQuery, callback_data: DayCallback, state: FSMContext):
+    lang = language_store.get(callback.from_user.id, 'ru')
+    await process_day_selection(callback, state, lang, callback_data.day)
+
+@callback_router.exact("pick_day")
+async def appointment_days(callback: types.CallbackQuery, state: FSMContext):
+    lang = language_store.get(callback.from_user.id, 'ru')
+    await process_day_selection(callback, state, lang)
+
+@callback_router.route(SlotCallback)
+async def appointment_slot(callback: types.CallbackQuery, callback_data: SlotCallback, state: FSMContext):
+    lang = language_store.get(callback.from_user.id, 'ru')
+    await process_slot_selection(callback, state, lang, callback_data.day, callback_data.slot)
+
+# Any other text is treated as a service search
+@dp.message(F.text, ~F.text.startswith('/'))
+async def search_fallback(message: types.Message, state: FSMContext):
+    await answer_search(message, message.text, state)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Medical center Telegram bot")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=os.getenv("BOT_MODE", "polling"),
+                        help="receive updates by long polling or through a webhook server")
+    parser.add_argument("--host", default=os.getenv("WEBHOOK_HOST", "0.0.0.0"), help="webhook server host")
+    parser.add_argument("--port", type=int, default=int(os.getenv("WEBHOOK_PORT", "8080")), help="webhook server port")
+    parser.add_argument("--path", default=os.getenv("WEBHOOK_PATH", "/webhook"), help="webhook URL path")
+    parser.add_argument("--webhook-url", default=os.getenv("WEBHOOK_URL"),
+                        help="public base URL to register with Telegram; omit to only accept local POSTs")
+    parser.add_argument("--max-in-flight", type=int, default=int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100")),
+                        help="maximum number of updates processed at once in webhook mode")
+    return parser.parse_args(argv)
+
+async def main(args=None):
+    if args is None:
+        args = parse_args([])
     bot = None
-    session = None
+    prewarm_task = None
     try:
-        print("Starting bot...")
         logger.info("Starting bot...")
         
-        # Create SSL context
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        
-        # Create connector with SSL context
-        connector = TCPConnector(ssl=ssl_context)
-        
-        # Create session with timeout
-        timeout = ClientTimeout(total=30)
-        session = ClientSession(connector=connector, timeout=timeout)
-        
-        # Create bot with custom session
+        # Pooled Bot API session; main() owns it and closes it once below
+        session = BotSession(
+            limit=int(os.getenv("BOT_POOL_SIZE", "100")),
+            keepalive_timeout=float(os.getenv("BOT_KEEPALIVE", "30")),
+            dns_ttl=int(os.getenv("BOT_DNS_TTL", "300")),
+            api_timeout=float(os.getenv("BOT_API_TIMEOUT", "10")),
+            upload_timeout=float(os.getenv("BOT_UPLOAD_TIMEOUT", "120"))
+        )
+        # Self-hosted Bot API server (or a fake one in benchmarks)
+        if os.getenv("BOT_API_URL"):
+            session.api = TelegramAPIServer.from_base(os.getenv("BOT_API_URL"))
         bot = Bot(token=BOT_TOKEN, session=session)
-        bot.parse_mode = "HTML"
+        bot.session.middleware(rate_limiter)
+        bot.session.middleware(ApiMetricsMiddleware())
         
-        # Test the bot connection
+        # Test the bot connection while the data files are loaded.
+        # bot.me() caches the result, so polling does not ask again.
+        me_task = asyncio.create_task(bot.me())
         try:
-            bot_info = await bot.get_me()
-            print(f"Bot connected successfully! Bot username: @{bot_info.username}")
+            await asyncio.to_thread(load_data)
+        except Exception:
+            me_task.cancel()
+            raise
+        try:
+            bot_info = await me_task
             logger.info(f"Bot connected successfully! Bot username: @{bot_info.username}")
         except Exception as e:
             error_msg = f"Failed to connect to Telegram: {str(e)}"
-            print(error_msg)
             logger.error(error_msg)
             raise
+
+        # Upload videos once to the admin chat so patients get cached file_ids;
+        # runs in the background so polling is not delayed by the uploads
+        if ADMIN_ID and os.getenv("MEDIA_PREWARM", "0") == "1":
+            prewarm_task = asyncio.create_task(prewarm_videos(bot))
         
+        if args.mode == "webhook":
+            from webhook import run_webhook
+            await run_webhook(
+                dp,
+                bot,
+                host=args.host,
+                port=args.port,
+                path=args.path,
+                secret_token=os.getenv("WEBHOOK_SECRET"),
+                max_in_flight=args.max_in_flight,
+                webhook_url=args.webhook_url
+            )
+            return
+
         # Start polling with proper cleanup
         await dp.start_polling(
             bot,
@@ -305,26 +567,29 @@ async def main():
             handle_signals=True,
             polling_timeout=30,
             drop_pending_updates=True,
-            close_bot_session=True
+            close_bot_session=False
         )
     except Exception as e:
         error_msg = f"Error starting bot: {str(e)}"
-        print(error_msg)
         logger.error(error_msg)
         raise
     finally:
+        # Stop video uploads before the session they use is closed
+        if prewarm_task is not None:
+            prewarm_task.cancel()
+            try:
+                await prewarm_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Video prewarm failed: {e}")
         # Close bot session
         if bot:
             await bot.session.close()
-        # Close aiohttp session
-        if session:
-            await session.close()
 
 if __name__ == '__main__':
     try:
-        print("Starting application...")
         logger.info("Starting application...")
-        import asyncio
         
         # Set longer timeout for Windows
         if sys.platform == 'win32':
@@ -335,12 +600,10 @@ if __name__ == '__main__':
         asyncio.set_event_loop(loop)
         
         # Run the main function
-        loop.run_until_complete(main())
+        loop.run_until_complete(main(parse_args()))
     except KeyboardInterrupt:
-        print("Bot stopped by user")
         logger.info("Bot stopped by user")
     except Exception as e:
-        print(f"Fatal error: {e}")
         logger.error(f"Fatal error: {e}")
         sys.exit(1)
     finally:
@@ -0,0 +1,340 @@
+"""Video files for the contacts menu: per-language variants, metadata and transcoding.
+
+Videos live in data/videos as `{name}_{lang}.mp4`, with `{name}.mp4` as a
+language-neutral fallback. `scan` probes them with ffprobe and stores
+duration, dimensions and a thumbnail in an index, which lets answer_video
+send proper metadata. `transcode` shrinks videos over Telegram's 50 MB
+upload limit and moves the MP4 index to the front for streaming; results
+go to data/videos/optimized and are preferred over the originals.
+
+    python media.py scan
+    python media.py transcode --workers 2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import struct
+import subprocess
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from aiogram.types import FSInputFile
+
+from logs import setup_logging_from_env
+
+logger = logging.getLogger(__name__)
+
+VIDEO_DIR = "data/videos"
+THUMBNAIL_DIR = os.path.join(VIDEO_DIR, "thumbnails")
+INDEX_PATH = os.path.join(VIDEO_DIR, "index.json")
+
+VIDEO_NAMES = ("location", "clinic")
+LANGUAGES = ("ru", "uz")
+
+# Telegram rejects bot uploads larger than this
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+
+def _candidates(name: str, lang: str, languages: Iterable[str]) -> List[str]:
+    names = [f"{name}_{lang}.mp4", f"{name}.mp4"]
+    # A video in another language is still better than none
+    names += [f"{name}_{other}.mp4" for other in languages if other != lang]
+    return names
+
+
+def resolve_video(name: str, lang: str, languages: Iterable[str] = LANGUAGES, video_dir: str = VIDEO_DIR) -> Optional[str]:
+    """Path of the video to send for `name` in `lang`, or None if there is none.
+
+    An optimized copy is used when it is at least as new as the original.
+    """
+    optimized_dir = os.path.join(video_dir, "optimized")
+    for filename in _candidates(name, lang, languages):
+        source = os.path.join(video_dir, filename)
+        optimized = os.path.join(optimized_dir, filename)
+        try:
+            source_mtime = os.stat(source).st_mtime_ns
+        except OSError:
+            source_mtime = None
+        try:
+            optimized_mtime = os.stat(optimized).st_mtime_ns
+        except OSError:
+            optimized_mtime = None
+        if optimized_mtime is not None and (source_mtime is None or optimized_mtime >= source_mtime):
+            return optimized
+        if source_mtime is not None:
+            return source
+    return None
+
+
+def video_variants(names: Iterable[str] = VIDEO_NAMES, languages: Iterable[str] = LANGUAGES) -> Dict[str, List[str]]:
+    """Video path -> languages it is sent for"""
+    languages = list(languages)
+    variants: Dict[str, List[str]] = {}
+    for name in names:
+        for lang in languages:
+            path = resolve_video(name, lang, languages)
+            if path:
+                variants.setdefault(path, []).append(lang)
+    return variants
+
+
+def is_faststart(path: str) -> bool:
+    """True if the MP4 index (moov) comes before the media data, so playback can start while downloading.
+
+    False as well for files that are not valid MP4 up to that point.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, kind = struct.unpack('>I4s', header)
+            if kind == b'moov':
+                return True
+            if kind == b'mdat':
+                return False
+            header_size = 8
+            if size == 1:
+                large = f.read(8)
+                if len(large) < 8:
+                    return False
+                size = struct.unpack('>Q', large)[0]
+                header_size = 16
+            elif size == 0:
+                return False
+            # A box smaller than its header: corrupt, and seeking back would loop forever
+            if size < header_size:
+                return False
+            f.seek(size - header_size, os.SEEK_CUR)
+
+
+# Blocking helpers, run in a process pool by the command line and in threads by the bot
+
+def probe(path: str) -> Dict[str, Any]:
+    """Duration and dimensions of the first video stream, read with ffprobe"""
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height,duration:format=duration", "-of", "json", path],
+        capture_output=True, text=True, check=True, timeout=60
+    ).stdout
+    info = json.loads(output)
+    stream = (info.get("streams") or [{}])[0]
+    duration = stream.get("duration") or info.get("format", {}).get("duration") or 0
+    return {
+        "duration": int(round(float(duration))),
+        "width": int(stream.get("width", 0)),
+        "height": int(stream.get("height", 0)),
+    }
+
+
+def make_thumbnail(path: str, thumbnail_path: str) -> None:
+    """JPEG frame at most 320 px wide, as Telegram expects for thumbnails"""
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-ss", "1", "-i", path, "-frames:v", "1",
+         "-vf", "scale='min(320,iw)':-2", "-q:v", "5", thumbnail_path],
+        capture_output=True, check=True, timeout=120
+    )
+
+
+def analyze(path: str, thumbnail_dir: str = THUMBNAIL_DIR) -> Dict[str, Any]:
+    """Index entry for one video"""
+    stat = os.stat(path)
+    entry = probe(path)
+    thumbnail = os.path.join(thumbnail_dir, os.path.splitext(os.path.basename(path))[0] + ".jpg")
+    try:
+        make_thumbnail(path, thumbnail)
+        entry["thumbnail"] = thumbnail
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"No thumbnail for {path}: {e}")
+    entry.update(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        faststart=is_faststart(path),
+    )
+    return entry
+
+
+def transcode(source: str, target: str, crf: int = 28, max_height: int = 720) -> Dict[str, Any]:
+    """Write a streamable copy of `source` to `target`.
+
+    Files within the upload limit are only remuxed with the index moved to
+    the front; larger ones are re-encoded to H.264/AAC at up to max_height.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_target = target + ".tmp.mp4"
+    if os.path.getsize(source) <= MAX_UPLOAD_SIZE:
+        codec = ["-c", "copy"]
+    else:
+        codec = ["-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf),
+                 "-vf", f"scale=-2:'min({max_height},ih)'", "-c:a", "aac", "-b:a", "96k"]
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-i", source, *codec, "-movflags", "+faststart", tmp_target],
+        capture_output=True, check=True
+    )
+    os.replace(tmp_target, target)
+    return {"source": source, "target": target, "size": os.path.getsize(target)}
+
+
+class MediaIndex:
+    """Metadata of the videos, keyed by path and checked against mtime and size"""
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self.thumbnail_dir = os.path.join(os.path.dirname(path), "thumbnails")
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable media index {self.path}: {e}")
+            return {}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, video_path: str) -> Optional[Dict[str, Any]]:
+        """Metadata of the current version of the file, if it was analyzed"""
+        entry = self._entries.get(os.path.normpath(video_path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(video_path)
+        except OSError:
+            return None
+        if entry.get("mtime_ns") != stat.st_mtime_ns or entry.get("size") != stat.st_size:
+            return None
+        return entry
+
+    def stale(self, video_paths: Iterable[str]) -> List[str]:
+        return [path for path in video_paths if os.path.exists(path) and self.get(path) is None]
+
+    def upload_kwargs(self, video_path: str) -> Dict[str, Any]:
+        """Extra answer_video arguments for uploading `video_path`"""
+        kwargs: Dict[str, Any] = {"supports_streaming": True}
+        entry = self.get(video_path)
+        if entry:
+            for field in ("duration", "width", "height"):
+                if entry.get(field):
+                    kwargs[field] = entry[field]
+            thumbnail = entry.get("thumbnail")
+            if thumbnail and os.path.exists(thumbnail):
+                kwargs["thumbnail"] = FSInputFile(thumbnail)
+        return kwargs
+
+    async def refresh(self, video_paths: Iterable[str], executor: Optional[Executor] = None) -> int:
+        """Analyze new or changed videos in `executor`; return how many were indexed.
+
+        Without an executor threads are used: the work is done by ffprobe and
+        ffmpeg child processes anyway, and forking the running bot could
+        deadlock on locks held by its other threads.
+        """
+        stale = self.stale(video_paths)
+        if not stale:
+            return 0
+        if shutil.which("ffprobe") is None:
+            logger.warning(f"ffprobe not found, {len(stale)} video(s) will be sent without metadata")
+            return 0
+        loop = asyncio.get_running_loop()
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1), thread_name_prefix="media")
+        try:
+            results = await asyncio.gather(
+                *(loop.run_in_executor(executor, analyze, path, self.thumbnail_dir) for path in stale),
+                return_exceptions=True
+            )
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False)
+        indexed = 0
+        for path, result in zip(stale, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not analyze {path}: {result}")
+                continue
+            self._entries[os.path.normpath(path)] = result
+            indexed += 1
+        if indexed:
+            await asyncio.to_thread(self.save)
+            logger.info(f"Indexed {indexed} video(s)")
+        return indexed
+
+    async def start(self, video_paths: Iterable[str]) -> None:
+        """Refresh the index in the background"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self.refresh(list(video_paths)))
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._refresh_task = None
+
+
+def _video_files(video_dir: str) -> List[str]:
+    if not os.path.isdir(video_dir):
+        return []
+    return sorted(
+        os.path.join(video_dir, filename)
+        for filename in os.listdir(video_dir)
+        if filename.lower().endswith(".mp4")
+    )
+
+
+def main():
+    setup_logging_from_env()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video-dir", default=VIDEO_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("scan", help="probe videos and make thumbnails")
+    transcode_parser = commands.add_parser("transcode", help="make streamable copies, re-encoding videos over 50 MB")
+    transcode_parser.add_argument("--crf", type=int, default=28, help="x264 quality, higher is smaller")
+    transcode_parser.add_argument("--max-height", type=int, default=720)
+    transcode_parser.add_argument("--force", action="store_true", help="also redo videos that are already fine")
+    args = parser.parse_args()
+
+    for tool in ("ffprobe", "ffmpeg"):
+        if shutil.which(tool) is None:
+            parser.error(f"{tool} not found; install ffmpeg first")
+
+    sources = _video_files(args.video_dir)
+    optimized_dir = os.path.join(args.video_dir, "optimized")
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if args.command == "transcode":
+            jobs = []
+            for source in sources:
+                target = os.path.join(optimized_dir, os.path.basename(source))
+                if not args.force and os.path.getsize(source) <= MAX_UPLOAD_SIZE and is_faststart(source):
+                    logger.info(f"{source} is already streamable and small enough")
+                    continue
+                jobs.append((source, executor.submit(transcode, source, target, args.crf, args.max_height)))
+            for source, job in jobs:
+                try:
+                    result = job.result()
+                    logger.info(f"{result['target']}: {result['size'] / 1024 / 1024:.1f} MB")
+                except subprocess.CalledProcessError as e:
+                    logger.error(f"ffmpeg failed for {source}: {e.stderr.decode(errors='replace').strip()}")
+        # Index originals and optimized copies, whichever resolve_video picks
+        index = MediaIndex(os.path.join(args.video_dir, "index.json"))
+        count = asyncio.run(index.refresh(sources + _video_files(optimized_dir), executor))
+        logger.info(f"{count} video(s) indexed in {index.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_PATH = 'data/media_cache.json'
+
+
+class MediaCache:
+    """Persistent cache of Telegram file_ids for local video files.
+
+    Entries are keyed by (path, mtime, size, lang), so replacing a video on
+    disk invalidates its cached file_id automatically. With a MediaIndex,
+    uploads carry duration, dimensions and a thumbnail.
+    """
+
+    def __init__(self, path: str = MEDIA_CACHE_PATH, index=None):
+        self.path = path
+        self.index = index
+        self._entries = self._load()
+        self._locks = {}
+        # Saves run in threads and may overlap; only the newest one is written
+        self._save_lock = threading.Lock()
+        self._version = 0
+        self._saved_version = 0
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable media cache {self.path}: {e}")
+            return {}
+
+    def _save(self, entries, version: int):
+        with self._save_lock:
+            if version <= self._saved_version:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._saved_version = version
+
+    async def _persist(self):
+        """Write the cache file in a thread, from a copy taken on the event loop"""
+        self._version += 1
+        try:
+            await asyncio.to_thread(self._save, dict(self._entries), self._version)
+        except OSError as e:
+            logger.warning(f"Could not persist media cache: {e}")
+
+    @staticmethod
+    def make_key(video_path: str, lang: str) -> str:
+        stat = os.stat(video_path)
+        return f"{os.path.normpath(video_path)}|{stat.st_mtime_ns}|{stat.st_size}|{lang}"
+
+    def _store(self, key: str, video_path: str, lang: str, file_id: str):
+        prefix = os.path.normpath(video_path) + '|'
+        suffix = '|' + lang
+        # Drop entries for older versions of the same file
+        for stale in [k for k in self._entries if k.startswith(prefix) and k.endswith(suffix) and k != key]:
+            del self._entries[stale]
+        self._entries[key] = file_id
+
+    async def get(self, video_path: str, lang: str):
+        """Return the cached file_id for the current version of the file, if any"""
+        return self._entries.get(await asyncio.to_thread(self.make_key, video_path, lang))
+
+    async def put(self, video_path: str, lang: str, file_id: str):
+        key = await asyncio.to_thread(self.make_key, video_path, lang)
+        self._store(key, video_path, lang, file_id)
+        await self._persist()
+
+    def _upload_kwargs(self, video_path: str):
+        if self.index is None:
+            return {"supports_streaming": True}
+        return self.index.upload_kwargs(video_path)
+
+    async def send_video(self, message, video_path: str, lang: str, **kwargs):
+        """Send a video, uploading it only if no valid file_id is cached"""
+        kwargs.setdefault("supports_streaming", True)
+        # stat() of the file, like all file access here, stays off the event loop
+        key = await asyncio.to_thread(self.make_key, video_path, lang)
+        file_id = self._entries.get(key)
+        if file_id:
+            try:
+                return await message.answer_video(video=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached file_id for {video_path} rejected, re-uploading: {e}")
+                if self._entries.pop(key, None) is not None:
+                    await self._persist()
+
+        # Only one upload per file at a time; concurrent taps wait for it
+        lock = self._locks.setdefault((video_path, lang), asyncio.Lock())
+        async with lock:
+            file_id = self._entries.get(key)
+            if file_id:
+                return await message.answer_video(video=file_id, **kwargs)
+            upload_kwargs = await asyncio.to_thread(self._upload_kwargs, video_path)
+            sent = await message.answer_video(video=FSInputFile(video_path), **{**upload_kwargs, **kwargs})
+            if sent.video:
+                self._store(key, video_path, lang, sent.video.file_id)
+                await self._persist()
+            return sent
+
+    def _keys(self, video_path: str, langs):
+        """Cache keys of the file for each language, or None if it does not exist"""
+        try:
+            return {lang: self.make_key(video_path, lang) for lang in langs}
+        except OSError:
+            return None
+
+    async def prewarm(self, bot, chat_id: int, video_paths, langs):
+        """Upload each video once to chat_id and cache its file_id for all languages"""
+        for video_path in video_paths:
+            keys = await asyncio.to_thread(self._keys, video_path, langs)
+            if keys is None:
+                continue
+            if all(key in self._entries for key in keys.values()):
+                continue
+            try:
+                upload_kwargs = await asyncio.to_thread(self._upload_kwargs, video_path)
+                sent = await bot.send_video(chat_id=chat_id, video=FSInputFile(video_path), **upload_kwargs)
+            except Exception as e:
+                logger.warning(f"Failed to pre-warm {video_path}: {e}")
+                continue
+            if sent.video:
+                for lang, key in keys.items():
+                    self._store(key, video_path, lang, sent.video.file_id)
+                await self._persist()
+                logger.info(f"Pre-warmed media cache for {video_path}")
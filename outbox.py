@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from db import open_db, state_path
+from ratelimit import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
+
+
+class AdminOutbox:
+    """Durable queue of notifications for the clinic admins.
+
+    enqueue() stores a notification for every recipient and returns right
+    away; a background task sends them, merging bursts into digest messages,
+    waiting out Telegram's RetryAfter and backing off on other errors.
+    """
+
+    def __init__(
+        self,
+        recipients: Sequence[int],
+        path: Optional[str] = None,
+        batch_window: float = 2.0,
+        max_batch: int = 20,
+        max_backoff: float = 300.0,
+        poll_interval: float = 30.0
+    ):
+        self.recipients = [r for r in recipients if r]
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self._conn = open_db(path or state_path("outbox.sqlite3"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS admin_outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, "
+            "recipient INTEGER NOT NULL, text TEXT NOT NULL, sent_at REAL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS admin_outbox_unsent ON admin_outbox (recipient, id) WHERE sent_at IS NULL"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._retry_at: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # Blocking database access, run in a worker thread
+
+    def _insert(self, text: str) -> None:
+        now = time.time()
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO admin_outbox (created_at, recipient, text) VALUES (?, ?, ?)",
+                    [(now, recipient, text) for recipient in self.recipients]
+                )
+
+    def _fetch_unsent(self, recipient: int) -> List[Tuple[int, str]]:
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT id, text FROM admin_outbox WHERE recipient = ? AND sent_at IS NULL ORDER BY id LIMIT ?",
+                (recipient, self.max_batch)
+            ).fetchall()
+
+    def _mark_sent(self, ids: List[int]) -> None:
+        now = time.time()
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany("UPDATE admin_outbox SET sent_at = ? WHERE id = ?", [(now, i) for i in ids])
+
+    def _mark_failed(self, ids: List[int]) -> None:
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany("UPDATE admin_outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+
+    def _pending_count(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM admin_outbox WHERE sent_at IS NULL").fetchone()[0]
+
+    # Queue
+
+    async def enqueue(self, text: str) -> None:
+        """Persist a notification for every admin and wake up the sender"""
+        if not self.recipients:
+            return
+        await asyncio.to_thread(self._insert, text)
+        self._wakeup.set()
+
+    @staticmethod
+    def build_digests(texts: List[str]) -> List[List[int]]:
+        """Group message indexes into digests that fit into one Telegram message"""
+        groups: List[List[int]] = []
+        length = 0
+        for i, text in enumerate(texts):
+            added = len(text) + (len(DIGEST_SEPARATOR) if groups and groups[-1] else 0)
+            if not groups or length + added > MAX_MESSAGE_LENGTH:
+                groups.append([i])
+                length = len(text)
+            else:
+                groups[-1].append(i)
+                length += added
+        return groups
+
+    async def _send_to(self, bot: Bot, recipient: int) -> bool:
+        """Send everything queued for one admin; return False if it has to be retried later"""
+        rows = await asyncio.to_thread(self._fetch_unsent, recipient)
+        if not rows:
+            return True
+        texts = [text[:MAX_MESSAGE_LENGTH] for _, text in rows]
+        for group in self.build_digests(texts):
+            ids = [rows[i][0] for i in group]
+            text = DIGEST_SEPARATOR.join(texts[i] for i in group)
+            try:
+                await bot.send_message(chat_id=recipient, text=text)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood control for admin {recipient}, retrying in {e.retry_after}s")
+                self._retry_at[recipient] = time.monotonic() + e.retry_after
+                return False
+            except TelegramAPIError as e:
+                failures = self._failures.get(recipient, 0) + 1
+                self._failures[recipient] = failures
+                delay = min(self.max_backoff, 2 ** failures)
+                logger.error(f"Failed to notify admin {recipient} (attempt {failures}), retrying in {delay}s: {e}")
+                self._retry_at[recipient] = time.monotonic() + delay
+                await asyncio.to_thread(self._mark_failed, ids)
+                return False
+            await asyncio.to_thread(self._mark_sent, ids)
+            self._failures.pop(recipient, None)
+        return len(rows) < self.max_batch
+
+    async def flush(self, bot: Bot) -> bool:
+        """Try to deliver everything now; return True if nothing is left to retry"""
+        done = True
+        now = time.monotonic()
+        for recipient in self.recipients:
+            if self._retry_at.get(recipient, 0) > now:
+                done = False
+                continue
+            try:
+                if not await self._send_to(bot, recipient):
+                    done = False
+            except Exception as e:
+                logger.error(f"Admin outbox error for {recipient}: {e}")
+                done = False
+        return done
+
+    async def _run(self, bot: Bot) -> None:
+        with bulk_sends():
+            await self._loop(bot)
+
+    async def _loop(self, bot: Bot) -> None:
+        while True:
+            done = await self.flush(bot)
+            if done:
+                # Also look at the table now and then: other bot processes
+                # sharing it cannot wake this one up
+                timeout = self.poll_interval
+            else:
+                # Something is waiting for a retry
+                retry_in = min((t for t in self._retry_at.values()), default=0) - time.monotonic()
+                timeout = max(retry_in, self.batch_window)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Let a burst of new appointments pile up into one digest
+            await asyncio.sleep(self.batch_window)
+
+    async def start(self, bot: Bot) -> None:
+        if self._task is None and self.recipients:
+            pending = await asyncio.to_thread(self._pending_count)
+            if pending:
+                logger.info(f"Admin outbox has {pending} undelivered notification(s)")
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._db_lock:
+            self._conn.close()
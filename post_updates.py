@@ -0,0 +1,51 @@
+"""POST recorded Telegram updates to a locally running webhook server.
+
+Updates are read from a file with one JSON update per line, e.g.:
+
+    python post_updates.py updates.jsonl --url http://127.0.0.1:8080/webhook
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import ClientSession
+
+
+async def post_updates(url, updates, secret=None, concurrency=10):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async with ClientSession(headers=headers) as session:
+        async def post(update):
+            async with semaphore:
+                async with session.post(url, json=update) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="file with one JSON update per line")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"), help="value of the secret token header")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    start = time.perf_counter()
+    statuses = asyncio.run(post_updates(args.url, updates, args.secret, args.concurrency))
+    elapsed = time.perf_counter() - start
+    print(f"Posted {len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.0f}/s)")
+    for status, count in sorted(statuses.items()):
+        print(f"  HTTP {status}: {count}")
+
+
+if __name__ == "__main__":
+    main()
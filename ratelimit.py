@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import Histogram, registry
+
+logger = logging.getLogger(__name__)
+
+# Lower value goes first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Priority of Bot API calls made in the current task; replies to patients by default
+send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+queue_wait = registry.register(Histogram(
+    "bot_api_queue_wait_seconds", "Time Bot API calls waited for the rate limiter", ("priority",)))
+
+
+@contextmanager
+def bulk_sends() -> Iterator[None]:
+    """Mark Bot API calls made inside the block as bulk"""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """Reservation-based token bucket.
+
+    reserve() always takes a token and returns how long the caller has to
+    wait for it, so callers of one bucket are served in arrival order.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def block(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` (Telegram's RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class PriorityBucket(TokenBucket):
+    """Token bucket whose waiters are served by priority, then in arrival order"""
+
+    __slots__ = ('_waiters', '_counter', '_timer')
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _ready(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1 and self.blocked_until <= now
+
+    async def acquire(self, priority: int = INTERACTIVE) -> None:
+        if not self._waiters and self._ready(time.monotonic()):
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule()
+        await future
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        delay = max((1 - self.tokens) / self.rate, self.blocked_until - now, 0.0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self) -> None:
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters and self._ready(now):
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # the waiting call was cancelled
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        self._schedule()
+
+    def block(self, seconds: float) -> None:
+        super().block(seconds)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._waiters:
+            self._schedule()
+
+
+class RateLimiter(BaseRequestMiddleware):
+    """Keeps Bot API calls within Telegram's flood limits (bot.session.middleware).
+
+    Every call addressed to a chat first waits for that chat's bucket, then
+    for the global one, where interactive replies overtake bulk sends (see
+    bulk_sends()). When Telegram still answers with RetryAfter, the chat (or
+    everything, for calls without a chat) is paused for the requested time
+    and the call is retried.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        max_retries: int = 3,
+        idle_check_interval: float = 60.0
+    ):
+        self.global_bucket = PriorityBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.idle_check_interval = idle_check_interval
+        self._chats: Dict[int, TokenBucket] = {}
+        self._last_idle_check = time.monotonic()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _drop_idle_buckets(self) -> None:
+        now = time.monotonic()
+        if now - self._last_idle_check < self.idle_check_interval:
+            return
+        self._last_idle_check = now
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    async def wait(self, chat_id: Optional[int], priority: int) -> float:
+        """Wait for a free slot; return how long that took"""
+        started = time.monotonic()
+        if chat_id is not None:
+            self._drop_idle_buckets()
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await self.global_bucket.acquire(priority)
+        waited = time.monotonic() - started
+        queue_wait.observe(waited, PRIORITY_NAMES.get(priority, str(priority)))
+        return waited
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if not isinstance(chat_id, int):
+            # Usernames of channels and calls without a chat (getUpdates,
+            # answerCallbackQuery, ...) are not counted against chat limits
+            chat_id = None
+            if not hasattr(method, 'chat_id'):
+                return await make_request(bot, method)
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self.wait(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    f"Flood control on {method.__api_method__} for chat {chat_id}, retrying in {e.retry_after}s"
+                )
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).block(e.retry_after)
+                else:
+                    self.global_bucket.block(e.retry_after)
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import Update
+
+
+class _UserQueue:
+    __slots__ = ('lock', 'depth')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class UpdateScheduler(BaseEventIsolation):
+    """Runs updates of different users concurrently and each user's updates in order.
+
+    Used as the dispatcher's events isolation, so an update waits for the
+    previous update of the same user before its FSM state is read. At most
+    `max_concurrency` updates run at once, and admit() makes the update
+    source wait while `max_pending` admitted updates are unfinished.
+    """
+
+    def __init__(self, max_concurrency: int = 64, max_pending: int = 1000):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._queues: Dict[int, _UserQueue] = {}
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._has_capacity = asyncio.Event()
+        self._has_capacity.set()
+        self.pending = 0
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.peak_pending = 0
+
+    async def admit(self) -> None:
+        """Wait until there is room for another update and reserve it"""
+        while self.pending >= self.max_pending:
+            self._has_capacity.clear()
+            await self._has_capacity.wait()
+        self.pending += 1
+        if self.pending > self.peak_pending:
+            self.peak_pending = self.pending
+
+    def release(self) -> None:
+        """Mark an admitted update as finished"""
+        if self.pending > 0:
+            self.pending -= 1
+        self.completed += 1
+        if self.pending < self.max_pending:
+            self._has_capacity.set()
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        queue = self._queues.get(key.user_id)
+        if queue is None:
+            queue = self._queues[key.user_id] = _UserQueue()
+        queue.depth += 1
+        self.queued += 1
+        try:
+            async with queue.lock:
+                async with self._slots:
+                    self.running += 1
+                    try:
+                        yield
+                    finally:
+                        self.running -= 1
+        finally:
+            queue.depth -= 1
+            self.queued -= 1
+            if queue.depth == 0:
+                del self._queues[key.user_id]
+
+    def queue_depth(self, user_id: int) -> int:
+        queue = self._queues.get(user_id)
+        return queue.depth if queue else 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current queue metrics"""
+        return {
+            'pending': self.pending,
+            'running': self.running,
+            'waiting': self.queued - self.running,
+            'active_users': len(self._queues),
+            'max_user_depth': max((q.depth for q in self._queues.values()), default=0),
+            'peak_pending': self.peak_pending,
+            'completed': self.completed,
+        }
+
+    async def close(self) -> None:
+        self._queues.clear()
+
+
+class SchedulingDispatcher(Dispatcher):
+    """Dispatcher whose polling loop stops fetching updates while the scheduler is full.
+
+    `gate(bot, update)` runs before an update waits for its user or a free
+    slot; updates it returns False for are not handled.
+    """
+
+    def __init__(
+        self,
+        scheduler: UpdateScheduler,
+        gate: Optional[Callable[[Bot, Update], bool]] = None,
+        **kwargs: Any
+    ):
+        super().__init__(events_isolation=scheduler, **kwargs)
+        self.scheduler = scheduler
+        self.gate = gate
+
+    async def _listen_updates(self, *args: Any, **kwargs: Any):
+        async for update in super()._listen_updates(*args, **kwargs):
+            await self.scheduler.admit()
+            yield update
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        # Handlers and logs measure from here, including the wait for the lock
+        kwargs.setdefault('update_received', time.perf_counter())
+        try:
+            if self.gate is not None and not self.gate(bot, update):
+                return None
+            return await super().feed_update(bot, update, **kwargs)
+        finally:
+            self.scheduler.release()
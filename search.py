@@ -0,0 +1,142 @@
+"""Fuzzy search over service names in every language.
+
+Names are normalized to one Latin spelling (Cyrillic is transliterated the
+way Uzbek Latin writes it), so "узи", "uzi" and "UZI" find the same
+services, and split into trigrams. A query is scored by the share of its
+trigrams found in a service's names; trigrams that occur in a large part of
+the catalog are skipped when collecting candidates, which keeps lookups
+fast on big catalogs.
+"""
+import heapq
+import re
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterable, List, NamedTuple, Set, Tuple
+
+if TYPE_CHECKING:
+    from catalog import Catalog
+
+_CYRILLIC = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ў': 'o', 'қ': 'k', 'ғ': 'g', 'ҳ': 'h',
+}
+_TRANSLITERATION = str.maketrans(_CYRILLIC)
+# Latin spellings that mean the same sound
+_LATIN = (('zh', 'j'), ('kh', 'x'), ('q', 'k'), ('w', 'v'))
+_APOSTROPHES = re.compile(r"[’'`ʻʼ‘]")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase Latin form of `text`, words separated by single spaces"""
+    text = _APOSTROPHES.sub('', text.lower()).translate(_TRANSLITERATION)
+    for spelling, canonical in _LATIN:
+        text = text.replace(spelling, canonical)
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of each word, padded so word beginnings weigh more"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchHit(NamedTuple):
+    category_id: int
+    service_id: int
+    score: float
+
+
+class SearchIndex:
+    """Trigram index of services, built once per catalog snapshot.
+
+    Candidates are the services sharing the most query trigrams, found by
+    intersecting trigram postings from the rarest up and skipping any
+    trigram that would leave nothing (a typo). Document ids are ordered by
+    name length, so among equally good candidates the lowest ids are the
+    shortest names.
+    """
+
+    def __init__(self, documents: Iterable[Tuple[Tuple[int, int], Iterable[str]]] = (),
+                 seeds: int = 3, max_grams: int = 8, min_score: float = 0.5):
+        self.seeds = seeds
+        self.max_grams = max_grams
+        self.min_score = min_score
+        indexed = []
+        for key, names in documents:
+            grams = set()
+            for name in names:
+                grams |= trigrams(normalize(name))
+            indexed.append((len(grams), key, frozenset(grams)))
+        indexed.sort(key=lambda doc: doc[0])
+        self._keys: List[Tuple[int, int]] = [key for _, key, _ in indexed]
+        self._grams: List[FrozenSet[str]] = [grams for _, _, grams in indexed]
+        postings: Dict[str, Set[int]] = {}
+        for doc, grams in enumerate(self._grams):
+            for gram in grams:
+                postings.setdefault(gram, set()).add(doc)
+        # Trigrams of the same words share one posting object, so a query
+        # intersects each distinct set once
+        interned: Dict[FrozenSet[int], FrozenSet[int]] = {}
+        self._postings: Dict[str, FrozenSet[int]] = {}
+        for gram, docs in postings.items():
+            docs = frozenset(docs)
+            self._postings[gram] = interned.setdefault(docs, docs)
+
+    @classmethod
+    def from_catalog(cls, catalog: "Catalog", **kwargs) -> "SearchIndex":
+        documents = []
+        for category in catalog.categories:
+            count = min(len(items) for items in category.services.values())
+            for service_id in range(count):
+                names = [category.services[lang][service_id].name for lang in catalog.languages]
+                documents.append(((category.category_id, service_id), names))
+        return cls(documents, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _candidates(self, postings: List[FrozenSet[int]], enough: int) -> FrozenSet[int]:
+        # The rarest trigrams narrow the search the most; the rest only
+        # matter for scoring
+        postings = postings[:self.max_grams]
+        best, best_used = frozenset(), 0
+        # A misspelled trigram may be the rarest one, so start from a few
+        for seed in range(min(self.seeds, len(postings))):
+            candidates, used = postings[seed], 1
+            for posting in postings:
+                if posting is postings[seed]:
+                    continue
+                narrowed = candidates & posting
+                if narrowed:
+                    candidates, used = narrowed, used + 1
+                    if len(candidates) <= enough:
+                        break
+            if used > best_used:
+                best, best_used = candidates, used
+            if used == len(postings) or len(candidates) <= enough:
+                break
+        return best
+
+    def search(self, query: str, limit: int = 5) -> List[SearchHit]:
+        query_grams = trigrams(normalize(query))
+        postings = sorted(
+            {self._postings[gram] for gram in query_grams if gram in self._postings},
+            key=len
+        )
+        if not postings:
+            return []
+        shortlist = heapq.nsmallest(limit * 4, self._candidates(postings, limit * 4))
+
+        total = len(query_grams)
+        scored = []
+        for doc in shortlist:
+            score = len(query_grams & self._grams[doc]) / total
+            if score >= self.min_score:
+                scored.append((-score, doc))
+        scored.sort()
+        return [SearchHit(*self._keys[doc], -score) for score, doc in scored[:limit]]
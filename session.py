@@ -0,0 +1,50 @@
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+
+
+class BotSession(AiohttpSession):
+    """Bot API session with a tuned connection pool and separate timeouts.
+
+    Ordinary API calls get `api_timeout`; calls that upload a file (videos
+    from the contacts menu) get the much longer `upload_timeout`. Calls with
+    an explicit timeout, like long polling, keep theirs. Connections are
+    reused for `keepalive_timeout` seconds (None turns keep-alive off) and
+    DNS answers are cached for `dns_ttl` seconds.
+
+    The session belongs to whoever created it and is closed exactly once,
+    through bot.session.close().
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: Optional[float] = 30.0,
+        dns_ttl: int = 300,
+        api_timeout: float = 10.0,
+        upload_timeout: float = 120.0,
+        **kwargs: Any
+    ):
+        super().__init__(limit=limit, timeout=api_timeout, **kwargs)
+        self.upload_timeout = upload_timeout
+        self._connector_init.update(limit_per_host=limit_per_host, ttl_dns_cache=dns_ttl)
+        if keepalive_timeout is None:
+            self._connector_init['force_close'] = True
+        else:
+            self._connector_init['keepalive_timeout'] = keepalive_timeout
+
+    @staticmethod
+    def has_upload(method: TelegramMethod[Any]) -> bool:
+        return any(isinstance(value, InputFile) for value in method.__dict__.values())
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None
+    ) -> TelegramType:
+        if timeout is None and self.has_upload(method):
+            timeout = self.upload_timeout
+        return await super().make_request(bot, method, timeout=timeout)
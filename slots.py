@@ -0,0 +1,271 @@
+"""Free appointment slots and their reservation.
+
+The day is split into slots of `slot_minutes` counted from midnight, so slot
+i starts at i * slot_minutes. Working hours become one bitmask per weekday,
+and bookings one bitmask per (category, day); the free slots of a day are
+`working & ~taken`, a couple of integer operations however many bookings
+there are.
+
+A reservation first claims its bit in memory, which is atomic within the
+event loop, then is written to SQLite where the primary key on (category,
+day, slot) settles races with other processes. Writes are batched: all
+reservations made while the previous batch was being written go into one
+transaction.
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from db import open_db, state_path
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_RANGE = re.compile(r"^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$")
+MIN_SLOT_MINUTES = 5
+# Slots of a day with the shortest slot_minutes; larger indexes are never valid
+MAX_SLOTS_PER_DAY = 1440 // MIN_SLOT_MINUTES
+
+
+@dataclass(frozen=True)
+class Schedule:
+    """Working hours as slot bitmasks, one per weekday (Monday first)"""
+    slot_minutes: int
+    days_ahead: int
+    min_lead_minutes: int
+    masks: Tuple[int, ...]
+
+    @classmethod
+    def from_dict(cls, config: Mapping[str, Any]) -> "Schedule":
+        """Parse the "schedule" section of contacts.json; raises ValueError if it is malformed"""
+        slot_minutes = config.get('slot_minutes', 30)
+        if not isinstance(slot_minutes, int) or not MIN_SLOT_MINUTES <= slot_minutes <= 240 or 1440 % slot_minutes:
+            raise ValueError("slot_minutes must be a whole number of minutes that divides a day")
+        days_ahead = config.get('days_ahead', 7)
+        min_lead_minutes = config.get('min_lead_minutes', 60)
+        if not isinstance(days_ahead, int) or days_ahead < 1:
+            raise ValueError("days_ahead must be a positive number")
+        if not isinstance(min_lead_minutes, int) or min_lead_minutes < 0:
+            raise ValueError("min_lead_minutes must not be negative")
+        hours = config.get('hours')
+        if not isinstance(hours, Mapping):
+            raise ValueError("hours must map weekdays (mon ... sun) to time ranges")
+        unknown = set(hours) - set(WEEKDAYS)
+        if unknown:
+            raise ValueError(f"unknown weekdays in hours: {sorted(unknown)}")
+        masks = []
+        for weekday in WEEKDAYS:
+            ranges = hours.get(weekday) or ()
+            if isinstance(ranges, str):
+                ranges = (ranges,)
+            mask = 0
+            for text in ranges:
+                match = _RANGE.match(text.strip()) if isinstance(text, str) else None
+                if not match:
+                    raise ValueError(f"hours.{weekday}: expected ranges like '09:00-18:00', got {text!r}")
+                start_h, start_m, end_h, end_m = map(int, match.groups())
+                start, end = start_h * 60 + start_m, end_h * 60 + end_m
+                if not 0 <= start < end <= 1440:
+                    raise ValueError(f"hours.{weekday}: {text!r} is not a range within one day")
+                # Only slots that end before closing time
+                first = -(-start // slot_minutes)
+                last = end // slot_minutes
+                if last > first:
+                    mask |= ((1 << (last - first)) - 1) << first
+            masks.append(mask)
+        return cls(slot_minutes, days_ahead, min_lead_minutes, tuple(masks))
+
+    @property
+    def slots_per_day(self) -> int:
+        return 1440 // self.slot_minutes
+
+    def working(self, day: date) -> int:
+        return self.masks[day.weekday()]
+
+    def slot_time(self, slot: int) -> str:
+        minutes = slot * self.slot_minutes
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+    def days(self, today: date) -> List[date]:
+        return [today + timedelta(days=i) for i in range(self.days_ahead)]
+
+    def bookable_day(self, ordinal: int, today: date) -> Optional[date]:
+        """The day of a date ordinal (as in DayCallback) if it can be booked from `today`, else None"""
+        offset = ordinal - today.toordinal()
+        if not 0 <= offset < self.days_ahead:
+            return None
+        return today + timedelta(days=offset)
+
+    def too_soon(self, day: date, now: datetime) -> int:
+        """Slots of `day` that start too soon (or already started) to be booked"""
+        cutoff = now + timedelta(minutes=self.min_lead_minutes)
+        if day < cutoff.date():
+            return -1
+        if day > cutoff.date():
+            return 0
+        minutes = cutoff.hour * 60 + cutoff.minute + (1 if cutoff.second or cutoff.microsecond else 0)
+        # Slots starting before the cutoff
+        return (1 << -(-minutes // self.slot_minutes)) - 1
+
+
+def slot_bits(mask: int) -> List[int]:
+    """Indexes of the set bits, lowest first"""
+    slots = []
+    while mask:
+        low = mask & -mask
+        slots.append(low.bit_length() - 1)
+        mask ^= low
+    return slots
+
+
+class SlotIndex:
+    """Booked slots per (category, day) as bitmasks, backed by SQLite"""
+
+    def __init__(self, path: Optional[str] = None, refresh_interval: float = 30.0):
+        self.path = path or state_path("slots.sqlite3")
+        self.refresh_interval = refresh_interval
+        self._conn = open_db(self.path)
+        self._conn.executescript(
+            # Keyed on the category's key in services.json, which (unlike
+            # its position) survives categories being added or reordered
+            "CREATE TABLE IF NOT EXISTS booked_slots ("
+            "category TEXT NOT NULL, day TEXT NOT NULL, slot INTEGER NOT NULL, "
+            "time TEXT NOT NULL, service_id INTEGER, user_id INTEGER, created_at REAL NOT NULL, "
+            "PRIMARY KEY (category, day, slot));"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._taken: Dict[Tuple[str, date], int] = {}
+        self._batch: List[Tuple[Tuple[Any, ...], asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def free(self, schedule: Schedule, category: str, day: date, now: Optional[datetime] = None) -> int:
+        """Bitmask of the free slots of a day"""
+        if now is None:
+            now = datetime.now()
+        if not 0 <= (day - now.date()).days < schedule.days_ahead:
+            return 0
+        return schedule.working(day) & ~self._taken.get((category, day), 0) & ~schedule.too_soon(day, now)
+
+    def free_days(self, schedule: Schedule, category: str, now: Optional[datetime] = None) -> List[date]:
+        if now is None:
+            now = datetime.now()
+        return [day for day in schedule.days(now.date()) if self.free(schedule, category, day, now)]
+
+    def free_slots(self, schedule: Schedule, category: str, day: date, now: Optional[datetime] = None) -> List[int]:
+        return slot_bits(self.free(schedule, category, day, now))
+
+    async def reserve(
+        self,
+        schedule: Schedule,
+        category: str,
+        day: date,
+        slot: int,
+        service_id: int,
+        user_id: int
+    ) -> bool:
+        """Book a slot; False if it is not free (anymore) or not a slot of the schedule"""
+        # Callback data comes from the client: never shift by an unchecked index
+        if not 0 <= slot < schedule.slots_per_day:
+            return False
+        bit = 1 << slot
+        if not self.free(schedule, category, day) & bit:
+            return False
+        # Claimed before the first await, so no other update can take it
+        key = (category, day)
+        self._taken[key] = self._taken.get(key, 0) | bit
+        row = (category, day.isoformat(), slot, schedule.slot_time(slot), service_id, user_id, time.time())
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((row, future))
+        self._wakeup.set()
+        try:
+            return await future
+        except Exception:
+            self._taken[key] &= ~bit
+            raise
+
+    def _write(self, rows: List[Tuple[Any, ...]]) -> List[bool]:
+        with self._db_lock:
+            with self._conn:
+                # Another process may have booked the same slot first
+                return [
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO booked_slots (category, day, slot, time, service_id, user_id, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        row
+                    ).rowcount == 1
+                    for row in rows
+                ]
+
+    async def flush(self) -> None:
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        try:
+            results = await asyncio.to_thread(self._write, [row for row, _ in batch])
+        except Exception as e:
+            logger.error(f"Failed to store {len(batch)} slot reservations: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), booked in zip(batch, results):
+            if not future.done():
+                future.set_result(booked)
+
+    def _load(self, since: str) -> List[Tuple[str, str, int]]:
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT category, day, slot FROM booked_slots WHERE day >= ?", (since,)
+            ).fetchall()
+
+    async def refresh(self) -> None:
+        """Pick up slots booked by other processes"""
+        today = date.today()
+        rows = await asyncio.to_thread(self._load, today.isoformat())
+        taken = {key: mask for key, mask in self._taken.items() if key[1] >= today}
+        for category, day, slot in rows:
+            if not 0 <= slot < MAX_SLOTS_PER_DAY:
+                logger.warning(f"Ignoring booked slot {slot} of {day}: not a slot of any schedule")
+                continue
+            key = (category, date.fromisoformat(day))
+            taken[key] = taken.get(key, 0) | (1 << slot)
+        self._taken = taken
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + self.refresh_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, next_refresh - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if loop.time() >= next_refresh:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.error(f"Failed to refresh booked slots: {e}")
+                next_refresh = loop.time() + self.refresh_interval
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self.refresh()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
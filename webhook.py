@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Webhook handler that processes updates concurrently, at most `max_in_flight` at a time.
+
+    Telegram gets its response as soon as an update is accepted. When every
+    slot is busy the response is delayed until one frees up, which makes
+    Telegram slow down instead of piling up tasks in memory.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int = 100, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+
+    async def _feed_update(self, bot: Bot, update: Dict[str, Any], received: float) -> None:
+        try:
+            result = await self.dispatcher.feed_raw_update(
+                bot=bot, update=update, update_received=received, **self.data
+            )
+            if isinstance(result, TelegramMethod):
+                await self.dispatcher.silent_call_request(bot=bot, result=result)
+        except Exception as e:
+            logger.error(f"Failed to process update {update.get('update_id')}: {e}")
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        received = time.perf_counter()
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+        scheduler = getattr(self.dispatcher, 'scheduler', None)
+        if scheduler is not None:
+            await scheduler.admit()
+        await self._slots.acquire()
+        self.in_flight += 1
+        task = asyncio.create_task(self._feed_update(bot, update, received))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        # main() owns the bot session and closes it after the dispatcher's
+        # shutdown hooks, which still send messages
+        pass
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Wait for accepted updates to finish processing"""
+        tasks = list(self._background_feed_update_tasks)
+        if tasks:
+            logger.info(f"Waiting for {len(tasks)} update(s) to finish")
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    path: str = "/webhook",
+    secret_token: Optional[str] = None,
+    max_in_flight: int = 100,
+    webhook_url: Optional[str] = None,
+    **workflow_data: Any
+) -> None:
+    """Serve updates over HTTP until cancelled or stopped by SIGINT/SIGTERM.
+
+    If webhook_url is given the webhook is registered with Telegram on
+    startup; without it the server only accepts updates POSTed to it
+    directly, which is how it is tested locally.
+    """
+    app = web.Application()
+    handler = LimitedRequestHandler(dp, bot, max_in_flight=max_in_flight, secret_token=secret_token)
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot, **workflow_data)
+
+    if webhook_url:
+        async def set_webhook(_: web.Application) -> None:
+            await bot.set_webhook(
+                url=webhook_url.rstrip('/') + path,
+                secret_token=secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(max_in_flight, 100)
+            )
+            logger.info(f"Webhook set to {webhook_url.rstrip('/') + path}")
+        app.on_startup.append(set_webhook)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook server listening on http://{host}:{port}{path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows, or not the main thread
+            pass
+    try:
+        await stop.wait()
+        logger.info("Stopping webhook server")
+        await handler.drain()
+    finally:
+        await runner.cleanup()